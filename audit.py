@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import atexit
+import csv
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+
+class AuditLogger:
+    """CSV audit log written by a background thread.
+
+    The command path only puts a small record on a bounded queue. The writer thread formats records, writes them in
+    batches, flushes every `flush_interval` seconds and rotates the file once it grows past `max_bytes`
+    (0 disables rotation). Pending records are flushed on close, which is also registered with atexit.
+    """
+
+    def __init__(self, path: str, batch_size: int = 64, flush_interval: float = 1.0, max_bytes: int = 0,
+                 backup_count: int = 3, queue_size: int = 4096):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue: queue.Queue = queue.Queue(queue_size)
+
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file, delimiter=";")
+
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="audit", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def log(self, username: str, command: str, args):
+        # blocks only when the writer falls a whole queue behind
+        self.queue.put((time.time(), username, command, args))
+
+    def flush(self):
+        """Block until every record logged so far is written to disk."""
+        if self.closed:
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        atexit.unregister(self.close)
+
+    def run(self):
+        batch = []
+        # when the last batch was written, records are written at least every flush_interval even under steady load
+        last = time.monotonic()
+        running = True
+        while running:
+            timeout = max(last + self.flush_interval - time.monotonic(), 0) if batch else None
+            try:
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                record = ()
+            if record is None:
+                running = False
+            elif isinstance(record, threading.Event):
+                self.write(batch)
+                batch = []
+                last = time.monotonic()
+                record.set()
+                continue
+            elif record:
+                batch.append(record)
+                if len(batch) < self.batch_size and time.monotonic() - last < self.flush_interval:
+                    continue
+            self.write(batch)
+            batch = []
+            last = time.monotonic()
+        self.file.close()
+
+    def write(self, batch: list):
+        for timestamp, username, command, args in batch:
+            self.writer.writerow([datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S"), username, command,
+                                  args])
+        self.file.flush()
+        if self.max_bytes and self.file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        self.file = open(self.path, "w", newline="")
+        self.writer = csv.writer(self.file, delimiter=";")
@@ -0,0 +1,832 @@
+import argparse
+import fnmatch
+import importlib.util
+import io
+import random
+import re
+import shutil
+from contextlib import contextmanager
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import List
+
+import layers
+import parallel
+import search
+import snapshot
+from overlay import Overlay
+from structs import FileSystem, Directory, File
+
+# the repository, where the fresh interpreters of the launch benchmark import from
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_image(path: str, dirs: int, files: int, size: int = 16):
+    """Write a synthetic image with `dirs` top-level directories of `files` files each."""
+    now = int(time.time())
+    data = b"x" * size
+    with tarfile.open(path, "w") as tar:
+        info = tarfile.TarInfo("system")
+        info.type = tarfile.DIRTYPE
+        info.mtime = now
+        tar.addfile(info)
+        for d in range(dirs):
+            info = tarfile.TarInfo(f"system/d{d}")
+            info.type = tarfile.DIRTYPE
+            info.mtime = now
+            tar.addfile(info)
+            for f in range(files):
+                info = tarfile.TarInfo(f"system/d{d}/f{f}.txt")
+                info.size = size
+                info.mtime = now
+                tar.addfile(info, io.BytesIO(data))
+
+
+def make_tar(path: str, fanout: int, depth: int = 1, size: int = 16):
+    """Write a synthetic image: `depth` nested directories with `fanout` files in the deepest one."""
+    now = int(time.time())
+    data = b"x" * size
+    with tarfile.open(path, "w") as tar:
+        name = "system"
+        info = tarfile.TarInfo(name)
+        info.type = tarfile.DIRTYPE
+        info.mtime = now
+        tar.addfile(info)
+        for level in range(depth):
+            name = f"{name}/d{level}"
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.DIRTYPE
+            info.mtime = now
+            tar.addfile(info)
+        for i in range(fanout):
+            info = tarfile.TarInfo(f"{name}/f{i}.txt")
+            info.size = size
+            info.mtime = now
+            tar.addfile(info, io.BytesIO(data))
+
+
+@contextmanager
+def image_dir(build):
+    """Temporary working directory with a config.yaml and a system.tar written by `build(path)`."""
+    with tempfile.TemporaryDirectory() as tmp:
+        build(os.path.join(tmp, "system.tar"))
+        with open(os.path.join(tmp, "config.yaml"), "w") as file:
+            file.write("username: User\nhostname: localhost\nsystem_directory: ./system.tar\nlog_file: ./log.csv\n")
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(cwd)
+
+
+def make_tree(fanout: int) -> FileSystem:
+    system = FileSystem()
+    now = datetime.now()
+    directory = Directory(system, "dir", now)
+    for i in range(fanout):
+        File(directory, f"f{i}.txt", b"", 0, now)
+    return system
+
+
+def timeit(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_resolve(args):
+    print(f"{'fan-out':>10} {'lookup, us':>12} {'fill, ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for fanout in args.fanout:
+            system = make_tree(fanout)
+            cwd = system.get_child("dir")
+            last = f"f{fanout - 1}.txt"
+            lookup = timeit(lambda: system.search_by_coord(f"/dir/{last}") and cwd.search_by_coord(last), 10000)
+
+            path = os.path.join(tmp, f"fanout{fanout}.tar")
+            make_tar(path, fanout)
+            with tarfile.open(path) as tar:
+                start = time.perf_counter()
+                FileSystem().fill(tar)
+                fill = time.perf_counter() - start
+            print(f"{fanout:>10} {lookup * 1e6 / 2:>12.3f} {fill * 1e3:>10.1f}")
+
+
+def bench_paths(args):
+    """Deep and repeated lookups, uncached against the overlay's path cache."""
+    now = int(time.time())
+    system = FileSystem()
+    directories = [system]
+    for level in range(args.depth):
+        parent = directories[-1]
+        for f in range(args.files):
+            File(parent, f"f{f}.txt", None, 1, now)
+        directories.append(Directory(parent, f"d{level}", now))
+    system.aggregate_sizes()
+
+    random.seed(0)
+    paths = []
+    for _ in range(args.distinct):
+        level = random.randrange(1, args.depth)
+        parts = [f"d{i}" for i in range(level)]
+        form = random.randrange(3)
+        if form == 0:
+            path = "/" + "/".join(parts)
+        elif form == 1 and level > 1:
+            # mixed form, resolves to the same directory as the parts
+            path = "/".join(parts[:-1]) + f"/../{parts[-2]}/./{parts[-1]}"
+        elif form == 1:
+            path = parts[0]
+        else:
+            path = "/" + "/".join(parts) + f"/f{random.randrange(args.files)}.txt"
+        paths.append(path)
+    # a few hot paths take most of the lookups, as with repeated ls, cat and completion
+    hot = paths[:max(1, len(paths) // 20)]
+    workload = [random.choice(hot) if random.random() < args.hot else random.choice(paths)
+                for _ in range(args.lookups)]
+
+    start = time.perf_counter()
+    for path in workload:
+        system.search_by_coord(path)
+    uncached = time.perf_counter() - start
+
+    view = Overlay(system, args.cache_size)
+    start = time.perf_counter()
+    for path in workload:
+        view.resolve(system, path)
+    cached = time.perf_counter() - start
+
+    hits = view.paths.hits / (view.paths.hits + view.paths.misses)
+    print(f"{args.lookups} lookups of {args.distinct} paths, depth up to {args.depth}, cache of {args.cache_size}")
+    print(f"uncached {uncached / args.lookups * 1e6:.2f} us/lookup, cached {cached / args.lookups * 1e6:.2f} "
+          f"us/lookup, hit rate {hits:.1%}")
+
+
+def bench_load(args):
+    print(f"{'file size':>10} {'mode':>6} {'fill, ms':>10} {'peak, MiB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.size:
+            path = os.path.join(tmp, f"size{size}.tar")
+            make_tar(path, args.entries, size=size)
+            for lazy in (False, True):
+                with tarfile.open(path) as tar:
+                    tracemalloc.start()
+                    start = time.perf_counter()
+                    FileSystem().fill(tar, lazy)
+                    fill = time.perf_counter() - start
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                mode = "lazy" if lazy else "eager"
+                print(f"{size:>10} {mode:>6} {fill * 1e3:>10.1f} {peak / 2 ** 20:>10.1f}")
+
+
+def bench_startup(args):
+    print(f"{'entries':>10} {'tar parse, ms':>14} {'index save, ms':>15} {'index load, ms':>15} {'index, KiB':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for entries in args.entries:
+            path = os.path.join(tmp, f"image{entries}.tar")
+            make_image(path, args.dirs, entries // args.dirs)
+
+            start = time.perf_counter()
+            system = FileSystem()
+            with tarfile.open(path) as tar:
+                system.fill(tar)
+            parse = time.perf_counter() - start
+
+            start = time.perf_counter()
+            snapshot.save(system, path)
+            save = time.perf_counter() - start
+
+            start = time.perf_counter()
+            assert snapshot.load(FileSystem(), path)
+            load = time.perf_counter() - start
+
+            size = os.path.getsize(snapshot.index_path(path))
+            print(f"{entries:>10} {parse * 1e3:>14.1f} {save * 1e3:>15.1f} {load * 1e3:>15.1f} {size / 1024:>11.1f}")
+
+
+# run in a fresh interpreter, print the wall clock time once the prompt is shown, once a cat of a file near the
+# start of the image is done and once the image is loaded
+LAUNCH_SCRIPTS = {
+    "shell": """
+import time
+from console import Shell
+shell = Shell()
+print(time.time())
+"".join(shell.stream(shell.onecmd("cat /d0/f0.txt")))
+print(time.time())
+shell.system.wait()
+print(time.time())
+shell.logger.close()
+""",
+    # the order main.py starts the console in
+    "qt": """
+import time
+from console import read_config, load_system
+config = read_config()
+system = load_system(config)
+from PySide6.QtWidgets import QApplication
+app = QApplication([])
+from emulator import Console
+console = Console(config=config, system=system)
+console.show()
+app.processEvents()
+print(time.time())
+"".join(console.console.stream(console.console.onecmd("cat /d0/f0.txt")))
+print(time.time())
+system.wait()
+print(time.time())
+console.stopWorker()
+""",
+}
+
+
+def import_time(module: str) -> float:
+    """Cumulative import time of module in a fresh interpreter, in seconds, from -X importtime."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True,
+                            text=True, check=True, env=dict(os.environ, PYTHONPATH=ROOT))
+    for line in reversed(result.stderr.splitlines()):
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1e6
+    raise ValueError(f"no import time for {module}")
+
+
+def bench_launch(args):
+    print(f"{'module':>10} {'import, ms':>11}")
+    for module in args.modules:
+        print(f"{module:>10} {min(import_time(module) for _ in range(args.repeat)) * 1e3:>11.1f}")
+
+    # first cat: a file near the start of the archive, read while the rest of the image is still loading
+    print(f"{'frontend':>10} {'prompt, ms':>11} {'first cat, ms':>14} {'loaded, ms':>11}")
+    env = dict(os.environ, PYTHONPATH=ROOT, QT_QPA_PLATFORM="offscreen")
+    with image_dir(lambda path: make_tar(path, args.entries)):
+        for frontend, script in LAUNCH_SCRIPTS.items():
+            runs = []
+            for _ in range(args.repeat):
+                start = time.time()
+                result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                                        env=env)
+                prompt, cat, loaded = map(float, result.stdout.split()[-3:])
+                runs.append((prompt - start, cat - start, loaded - start))
+            prompt, cat, loaded = min(runs)
+            print(f"{frontend:>10} {prompt * 1e3:>11.1f} {cat * 1e3:>14.1f} {loaded * 1e3:>11.1f}")
+
+
+def bench_memory(args):
+    now = int(time.time())
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    system = FileSystem()
+    for d in range(args.dirs):
+        directory = Directory(system, f"d{d}", now)
+        for f in range(args.files):
+            File(directory, f"f{f}.txt", None, 16, now, None, 0)
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    nodes = args.dirs * (args.files + 1)
+    print(f"{nodes} nodes: {used / 2 ** 20:.1f} MiB, {used / nodes:.0f} B/node, "
+          f"{used / nodes * 1e6 / 2 ** 20:.0f} MiB per million nodes")
+
+
+def bench_deep(args):
+    now = int(time.time())
+    start = time.perf_counter()
+    system = FileSystem()
+    directory = system
+    per_level = args.files // args.depth
+    for level in range(args.depth):
+        directory = Directory(directory, f"d{level}", now)
+        for f in range(per_level):
+            File(directory, f"f{f}.txt", None, 1, now, None, 0)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    system.aggregate_sizes()
+    aggregate = time.perf_counter() - start
+    assert system.size == per_level * args.depth
+
+    start = time.perf_counter()
+    for node in directory.children:
+        node.abspath
+    paths = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        extra = File(None, "extra.txt", None, 1, now, None, 0)
+        directory.add(extra)
+        directory.remove("extra.txt")
+    update = (time.perf_counter() - start) / 2000
+    assert system.size == per_level * args.depth
+
+    print(f"depth {args.depth}, {per_level * args.depth} files: build {build * 1e3:.1f} ms, "
+          f"aggregate {aggregate * 1e3:.1f} ms, {per_level} deepest abspaths {paths * 1e3:.1f} ms, "
+          f"add/remove at the bottom {update * 1e6:.1f} us")
+
+
+def frame_gaps(start, done) -> list:
+    """Run the Qt event loop around `start` until `done()` and return the gaps between 1 ms timer ticks, in ms."""
+    from PySide6.QtCore import QEventLoop, QTimer
+
+    loop = QEventLoop()
+    ticks = []
+    timer = QTimer()
+    timer.setInterval(1)
+
+    def tick():
+        ticks.append(time.perf_counter())
+        if len(ticks) > 50 and done():
+            loop.quit()
+
+    timer.timeout.connect(tick)
+    timer.start()
+    QTimer.singleShot(50, start)
+    loop.exec()
+    timer.stop()
+    return [(b - a) * 1e3 for a, b in zip(ticks, ticks[1:])]
+
+
+def bench_complete(args):
+    from console import Shell
+
+    with image_dir(lambda path: make_tar(path, args.entries)):
+        shell = Shell()
+        shell.system.wait()
+        "".join(shell.stream(shell.onecmd("cd /d0")))
+        lines = ["cat ", "cat f", "cat f1", f"cat f{args.entries // 2}", "cat /d0/f9", "cat zz", "l", "ls | gr"]
+
+        start = time.perf_counter()
+        shell.complete_line("cat f")
+        cold = time.perf_counter() - start
+        print(f"{args.entries} entries, first completion (builds the listing) {cold * 1e3:.2f} ms")
+
+        print(f"{'line':>14} {'matches':>8} {'ms':>8}")
+        worst = 0
+        for line in lines:
+            elapsed = timeit(lambda: shell.complete_line(line), args.repeat)
+            matches = len(shell.complete_line(line)[2])
+            worst = max(worst, elapsed)
+            print(f"{line!r:>14} {matches:>8} {elapsed * 1e3:>8.3f}")
+        print(f"worst {worst * 1e3:.3f} ms, budget {args.budget} ms: {'ok' if worst * 1e3 <= args.budget else 'OVER'}")
+        shell.logger.close()
+
+
+def bench_history(args):
+    from history import History
+
+    random.seed(0)
+    words = [f"w{i}" for i in range(args.words)]
+    print(f"{'lines':>10} {'file, MiB':>10} {'load, ms':>9} {'index, ms':>10} {'indexed search, us':>19} "
+          f"{'scan, us':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for lines in args.lines:
+            path = os.path.join(tmp, f"history{lines}")
+            with open(path, "w") as file:
+                for _ in range(lines):
+                    command = random.choice(["cat", "ls -l", "grep -r", "cd"])
+                    file.write(f"{command} {' '.join(random.sample(words, 3))}\n")
+            size = os.path.getsize(path)
+            start = time.perf_counter()
+            history = History(path, args.size)
+            len(history)
+            load = time.perf_counter() - start
+
+            start = time.perf_counter()
+            history.search("")
+            index = time.perf_counter() - start
+
+            queries = [random.choice(words) + " " for _ in range(100)]
+            start = time.perf_counter()
+            for query in queries:
+                history.search(query)
+            indexed = (time.perf_counter() - start) / len(queries)
+            start = time.perf_counter()
+            for query in queries:
+                next((command for command in reversed(history.entries()) if query in command), None)
+            scan = (time.perf_counter() - start) / len(queries)
+            print(f"{lines:>10} {size / 2 ** 20:>10.1f} {load * 1e3:>9.1f} {index * 1e3:>10.1f} "
+                  f"{indexed * 1e6:>19.1f} {scan * 1e6:>9.1f}")
+
+
+def bench_ls(args):
+    from console import Shell
+
+    with image_dir(lambda path: make_tar(path, args.entries)):
+        shell = Shell()
+        shell.system.wait()
+        print(f"{'command':>12} {'first, ms':>10} {'repeated, ms':>13}")
+        for command in args.commands:
+            run = lambda: sum(len(chunk) for chunk in shell.stream(shell.onecmd(command)))  # noqa: E731
+            start = time.perf_counter()
+            run()
+            first = time.perf_counter() - start
+            repeated = timeit(run, args.repeat)
+            print(f"{command:>12} {first * 1e3:>10.1f} {repeated * 1e3:>13.1f}")
+        shell.logger.close()
+
+
+def bench_cal(args):
+    from console import Shell
+
+    with image_dir(lambda path: make_tar(path, 1)):
+        shell = Shell()
+        shell.system.wait()
+        print(f"{'command':>24} {'cold, us':>10} {'warm, us':>10}")
+        for command in args.commands:
+            run = lambda: "".join(shell.stream(shell.onecmd(command)))  # noqa: E731
+
+            def cold():
+                shell.calendars.clear()
+                run()
+
+            print(f"{command:>24} {timeit(cold, args.repeat) * 1e6:>10.1f} {timeit(run, args.repeat) * 1e6:>10.1f}")
+        shell.logger.close()
+
+
+def make_layer(path: str, dirs: range, files: int, size: int, whiteouts: List[str] = ()):
+    """Write one layer of a synthetic image: the directories in `dirs`, and whiteout markers for `whiteouts`.
+
+    Content is half random so that it compresses about as well as text. The path suffix picks the compression.
+    """
+    now = int(time.time())
+    random.seed(dirs.start)
+    plain = path + ".uncompressed" if layers.compression(path) else path
+    with tarfile.open(plain, "w") as tar:
+        info = tarfile.TarInfo("system")
+        info.type = tarfile.DIRTYPE
+        info.mtime = now
+        tar.addfile(info)
+        for d in dirs:
+            info = tarfile.TarInfo(f"system/d{d}")
+            info.type = tarfile.DIRTYPE
+            info.mtime = now
+            tar.addfile(info)
+            for f in range(files):
+                info = tarfile.TarInfo(f"system/d{d}/f{f}.txt")
+                info.size = size
+                info.mtime = now
+                tar.addfile(info, io.BytesIO(random.randbytes(size // 2).hex().encode()))
+        for name in whiteouts:
+            directory, _, base = name.rpartition("/")
+            info = tarfile.TarInfo(f"system{directory}/{layers.WHITEOUT}{base}")
+            info.mtime = now
+            tar.addfile(info, io.BytesIO(b""))
+    kind = layers.compression(path)
+    if kind is None:
+        return
+    with open(plain, "rb") as source, open(path, "wb") as target:
+        if kind == "gzip":
+            import gzip
+
+            with gzip.GzipFile(fileobj=target, mode="wb", compresslevel=6, mtime=now) as stream:
+                shutil.copyfileobj(source, stream, layers.CHUNK_SIZE)
+        else:
+            import zstandard
+
+            zstandard.ZstdCompressor().copy_stream(source, target)
+    os.remove(plain)
+
+
+def bench_layers(args):
+    if importlib.util.find_spec("zstandard") is not None:
+        suffixes = (".gz", ".zst")
+    else:
+        print("zstandard is not installed, .tar.zst images are left out")
+        suffixes = (".gz",)
+    with tempfile.TemporaryDirectory() as tmp:
+        images = {"plain": [os.path.join(tmp, "image.tar")]}
+        for suffix in suffixes:
+            images[f"tar{suffix}"] = [os.path.join(tmp, f"image.tar{suffix}")]
+            # the same tree split into a base and deltas, each delta hides a file of the layer below it
+            images[f"{args.layers} x tar{suffix}"] = [os.path.join(tmp, f"layer{i}.tar{suffix}")
+                                                      for i in range(args.layers)]
+        for name, paths in images.items():
+            if len(paths) == 1:
+                make_layer(paths[0], range(args.dirs), args.files, args.size)
+                continue
+            step = -(-args.dirs // len(paths))
+            for i, path in enumerate(paths):
+                whiteouts = [f"/d{(i - 1) * step}/f0.txt"] if i else []
+                make_layer(path, range(i * step, min((i + 1) * step, args.dirs)), args.files, args.size, whiteouts)
+
+        total = args.dirs * args.files * args.size
+        print(f"{args.dirs * args.files} files, {total / 2 ** 20:.0f} MiB, {os.cpu_count()} cores")
+        print(f"{'image':>14} {'on disk, MiB':>13} {'cold, ms':>9} {'1 thread, ms':>13} {'warm, ms':>9}")
+        reference = None
+        for name, paths in images.items():
+            disk = sum(os.path.getsize(path) for path in paths)
+
+            def clean():
+                # the plain copies and the indexes are what a warm start reuses
+                for path in os.listdir(tmp):
+                    if path.endswith((".plain", ".key", ".idx")):
+                        os.remove(os.path.join(tmp, path))
+
+            def load(workers=None) -> FileSystem:
+                system = FileSystem()
+                layers.restore(system, paths, workers=workers)
+                return system
+
+            clean()
+            start = time.perf_counter()
+            load()
+            cold = time.perf_counter() - start
+            clean()
+            start = time.perf_counter()
+            load(1)
+            serial = time.perf_counter() - start
+            start = time.perf_counter()
+            system = load()
+            warm = time.perf_counter() - start
+
+            files = sorted(node.abspath for node in search.walk(system) if node.isfile())
+            if reference is None:
+                reference = files
+            expected = len(reference) - (len(paths) - 1)
+            assert len(files) == expected and set(files) <= set(reference), name
+            print(f"{name:>14} {disk / 2 ** 20:>13.1f} {cold * 1e3:>9.1f} {serial * 1e3:>13.1f} {warm * 1e3:>9.1f}")
+
+
+def bench_ui(args):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+
+    with image_dir(lambda path: make_tar(path, args.entries)):
+        from emulator import Console
+
+        if QApplication.instance() is None:
+            # PySide keeps the application alive as qApp
+            QApplication([])
+        console = Console()
+        console.console.system.wait()
+        cmd = "ls -l /d0"
+        shell = console.console
+
+        def blocking():
+            # what onEnter did before: run the command and insert all of its output at once
+            console.textCursor().insertText("".join(shell.stream(shell.onecmd(cmd))))
+            ran.append(True)
+
+        ran = []
+        before = frame_gaps(blocking, lambda: ran)
+        after = frame_gaps(lambda: console.onEnter(cmd), lambda: not console.isLocked)
+        console.close()
+
+    print(f"'{cmd}' on {args.entries} entries, gap between 1 ms timer ticks:")
+    for name, gaps in (("blocking", before), ("streamed", after)):
+        gaps.sort()
+        print(f"  {name:>13}: max {gaps[-1]:.1f} ms, p99 {gaps[int(len(gaps) * 0.99)]:.1f} ms")
+
+
+def make_big_file(path: str, size: int):
+    line = "строка текста, line of text\n".encode()
+    data = line * (size // len(line))
+    with tarfile.open(path, "w") as tar:
+        info = tarfile.TarInfo("system")
+        info.type = tarfile.DIRTYPE
+        tar.addfile(info)
+        info = tarfile.TarInfo("system/big.txt")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
+def bench_cat(args):
+    from console import Shell
+
+    print(f"{'file, MiB':>10} {'decode all, MiB':>16} {'streamed cat, MiB':>18} {'cat, ms':>8}")
+    for size in args.size:
+        with image_dir(lambda path: make_big_file(path, size * 2 ** 20)):
+            shell = Shell()
+            shell.system.wait()
+
+            tracemalloc.start()
+            shell.system.get_child("big.txt").content.decode()
+            whole = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            for _ in shell.stream(shell.onecmd("cat big.txt")):
+                pass
+            elapsed = time.perf_counter() - start
+            streamed = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            shell.logger.close()
+        print(f"{size:>10} {whole / 2 ** 20:>16.1f} {streamed / 2 ** 20:>18.2f} {elapsed * 1e3:>8.1f}")
+
+
+def bench_search(args):
+    rng = random.Random(0)
+    words = [f"{rng.choice('bcdfghjklmnpqrstvwz')}{rng.choice('aeiou')}{i:x}" for i in range(args.words)]
+    now = int(time.time())
+    system = FileSystem()
+    for d in range(args.files // 1000 + 1):
+        directory = Directory(system, f"dir{d}", now)
+        for f in range(min(1000, args.files - d * 1000)):
+            content = " ".join(rng.choice(words) for _ in range(args.size // 6)).encode()
+            File(directory, f"file{d * 1000 + f}.txt", content, len(content), now)
+    system.aggregate_sizes()
+    needle = words[-1]
+
+    start = time.perf_counter()
+    search.name_index(system)
+    names = time.perf_counter() - start
+    start = time.perf_counter()
+    search.content_index(system)
+    content = time.perf_counter() - start
+    print(f"{args.files} files: name index {names * 1e3:.0f} ms, content index {content * 1e3:.0f} ms to build")
+
+    pattern = f"*{args.files - 7}.txt"
+    regex = re.compile(needle)
+
+    def brute_find():
+        return [node for node in search.walk(system) if fnmatch.fnmatchcase(node.name, pattern)]
+
+    def indexed_find():
+        return list(search.find(system, system, pattern))
+
+    def brute_grep():
+        return [file for file in search.walk(system) if file.isfile() and any(search.search_file(file, regex))]
+
+    def indexed_grep():
+        candidates = search.grep_candidates(system, needle)
+        return [file for file in search.grep_files(system, system, candidates) if any(search.search_file(file, regex))]
+
+    assert brute_find() == indexed_find() and brute_grep() == indexed_grep()
+    print(f"{'query':>26} {'tree walk, ms':>14} {'indexed, ms':>12}")
+    for name, brute, indexed in ((f"find -name '{pattern}'", brute_find, indexed_find),
+                                 (f"grep -r {needle}", brute_grep, indexed_grep)):
+        print(f"{name:>26} {timeit(brute, 3) * 1e3:>14.2f} {timeit(indexed, 3) * 1e3:>12.2f}")
+
+
+def bench_parallel(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "system.tar")
+        make_image(path, args.dirs, args.files, args.size * 1024)
+        system = FileSystem()
+        snapshot.restore(system, path)
+        files = [node for node in search.walk(system) if node.isfile()]
+        total = sum(file.size for file in files)
+        regex = re.compile("needle")
+        print(f"{len(files)} files, {total / 2 ** 20:.0f} MiB, {os.cpu_count()} cores")
+        print(f"{'workers':>8} {'md5 -r, s':>10} {'grep -r, s':>11}")
+        for workers in args.workers:
+            if workers > 1:
+                # start the pool outside of the measurement
+                parallel.pool(workers).submit(int).result()
+            start = time.perf_counter()
+            list(parallel.md5(files, workers))
+            md5 = time.perf_counter() - start
+            start = time.perf_counter()
+            list(parallel.grep(files, regex, workers))
+            grep = time.perf_counter() - start
+            print(f"{workers:>8} {md5:>10.2f} {grep:>11.2f}")
+
+
+def bench_overlay(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "system.tar")
+        make_image(path, args.dirs, args.files)
+        system = FileSystem()
+        system.fill(tarfile.open(path))
+        names = [f"/d{d}/f{f}.txt" for d in range(args.dirs) for f in range(args.files)]
+        random.seed(0)
+        for changes in args.changes:
+            view = Overlay(system)
+            tracemalloc.start()
+            base = tracemalloc.get_traced_memory()[0]
+            for i, name in enumerate(random.sample(names, changes)):
+                directory, _, file = name.rpartition("/")
+                directory = view.resolve(system, directory)
+                if i % 3 == 0:
+                    view.remove(directory, file)
+                elif i % 3 == 1:
+                    view.touch(directory, file)
+                else:
+                    view.write(directory, file, b"changed", append=True)
+            used = tracemalloc.get_traced_memory()[0] - base
+            tracemalloc.stop()
+            start = time.perf_counter()
+            with tarfile.open(os.path.join(tmp, "export.tar"), "w") as tar:
+                members = sum(1 for _ in view.export(tar, system))
+            elapsed = time.perf_counter() - start
+            print(f"{changes:>7} changes on {len(names)} files: overlay {used / 2 ** 10:.0f} KiB, "
+                  f"export {members} members in {elapsed:.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shell emulator benchmarks.")
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    resolve = subparsers.add_parser("resolve", help="path resolution time against directory fan-out")
+    resolve.add_argument("--fanout", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    resolve.set_defaults(func=bench_resolve)
+
+    paths = subparsers.add_parser("paths", help="deep and repeated path lookups, with and without the path cache")
+    paths.add_argument("--depth", type=int, default=50)
+    paths.add_argument("--files", type=int, default=100, help="files per directory")
+    paths.add_argument("--distinct", type=int, default=5000, help="distinct paths looked up")
+    paths.add_argument("--lookups", type=int, default=200000)
+    paths.add_argument("--hot", type=float, default=0.8, help="share of lookups going to the hottest 5%% of paths")
+    paths.add_argument("--cache-size", type=int, default=1024)
+    paths.set_defaults(func=bench_paths)
+
+    load = subparsers.add_parser("load", help="image load time and memory, eager against lazy content")
+    load.add_argument("--entries", type=int, default=1000)
+    load.add_argument("--size", type=int, nargs="+", default=[1024, 64 * 1024, 512 * 1024])
+    load.set_defaults(func=bench_load)
+
+    startup = subparsers.add_parser("startup", help="cold start from the tar against the saved index")
+    startup.add_argument("--entries", type=int, nargs="+", default=[10000, 100000])
+    startup.add_argument("--dirs", type=int, default=100)
+    startup.set_defaults(func=bench_startup)
+
+    memory = subparsers.add_parser("memory", help="memory used by the tree per million nodes")
+    memory.add_argument("--dirs", type=int, default=1000)
+    memory.add_argument("--files", type=int, default=1000)
+    memory.set_defaults(func=bench_memory)
+
+    deep = subparsers.add_parser("deep", help="size aggregation and path derivation on a deep tree")
+    deep.add_argument("--depth", type=int, default=2000)
+    deep.add_argument("--files", type=int, default=100000)
+    deep.set_defaults(func=bench_deep)
+
+    ui = subparsers.add_parser("ui", help="Qt frame latency while a heavy command runs")
+    ui.add_argument("--entries", type=int, default=100000)
+    ui.set_defaults(func=bench_ui)
+
+    cat = subparsers.add_parser("cat", help="peak memory of cat against file size")
+    cat.add_argument("--size", type=int, nargs="+", default=[1, 16, 64], help="file sizes in MiB")
+    cat.set_defaults(func=bench_cat)
+
+    find = subparsers.add_parser("search", help="indexed find and grep against a brute-force tree walk")
+    find.add_argument("--files", type=int, default=20000)
+    find.add_argument("--size", type=int, default=1024, help="bytes of text per file")
+    find.add_argument("--words", type=int, default=50000, help="vocabulary size")
+    find.set_defaults(func=bench_search)
+
+    scaling = subparsers.add_parser("parallel", help="md5 -r and grep -r scaling with the number of workers")
+    scaling.add_argument("--dirs", type=int, default=10)
+    scaling.add_argument("--files", type=int, default=100, help="files per directory")
+    scaling.add_argument("--size", type=int, default=128, help="file size in KiB")
+    scaling.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    scaling.set_defaults(func=bench_parallel)
+
+    changes = subparsers.add_parser("overlay", help="overlay memory against the number of changes, and export time")
+    changes.add_argument("--dirs", type=int, default=100)
+    changes.add_argument("--files", type=int, default=1000, help="files per directory")
+    changes.add_argument("--changes", type=int, nargs="+", default=[10, 1000, 10000])
+    changes.set_defaults(func=bench_overlay)
+
+    complete = subparsers.add_parser("complete", help="tab completion time in a directory with many entries")
+    complete.add_argument("--entries", type=int, default=100000)
+    complete.add_argument("--repeat", type=int, default=200)
+    complete.add_argument("--budget", type=float, default=5.0, help="frame budget in ms")
+    complete.set_defaults(func=bench_complete)
+
+    history = subparsers.add_parser("history", help="history load time against file size, indexed search")
+    history.add_argument("--lines", type=int, nargs="+", default=[10000, 100000, 1000000])
+    history.add_argument("--size", type=int, default=10000, help="distinct commands kept")
+    history.add_argument("--words", type=int, default=5000)
+    history.set_defaults(func=bench_history)
+
+    launch = subparsers.add_parser("launch", help="import time of the entry modules and time from process start "
+                                                  "to the first prompt")
+    launch.add_argument("--modules", nargs="+", default=["console", "emulator", "server", "headless"])
+    launch.add_argument("--entries", type=int, default=10000)
+    launch.add_argument("--repeat", type=int, default=5)
+    launch.set_defaults(func=bench_launch)
+
+    cal = subparsers.add_parser("cal", help="cal time with an empty and a filled calendar cache")
+    cal.add_argument("--repeat", type=int, default=200)
+    cal.add_argument("--commands", nargs="+", default=["cal -d 2024-02", "cal -y 2024", "cal -3 -d 2024-02",
+                                                        "cal 2000-01..2009-12"])
+    cal.set_defaults(func=bench_cal)
+
+    ls = subparsers.add_parser("ls", help="ls time in a directory with many entries, first and repeated runs")
+    ls.add_argument("--entries", type=int, default=100000)
+    ls.add_argument("--repeat", type=int, default=5)
+    ls.add_argument("--commands", nargs="+", default=["ls /d0", "ls -l /d0", "ls -lS /d0", "ls -lt /d0"])
+    ls.set_defaults(func=bench_ls)
+
+    layered = subparsers.add_parser("layers", help="load time of plain, gzip and layered images, cold and warm")
+    layered.add_argument("--dirs", type=int, default=64)
+    layered.add_argument("--files", type=int, default=256, help="files per directory")
+    layered.add_argument("--size", type=int, default=4096, help="file size in bytes")
+    layered.add_argument("--layers", type=int, default=4, help="layers of the layered images")
+    layered.set_defaults(func=bench_layers)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
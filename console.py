@@ -1,108 +1,453 @@
+import bisect
 import cmd
-import csv
+import codecs
+import itertools
+import json
 
 import yaml
-import tarfile
-import calendar
-from structs import FileSystem, _HelpAction, ArgumentParser, ArgumentError
-from tabulate import tabulate
+import search
+from audit import AuditLogger
+from overlay import Overlay
+from stats import Stats
+from parsers import CURRENT_YEAR, Parsers
+from structs import FileSystem, LRUCache, ArgumentError, CommandCancelled
 from datetime import datetime
+from operator import attrgetter, itemgetter
+from typing import Iterator, List, Tuple
+import os
 import shlex
 import re
+import threading
+
+# bytes of file content per output chunk
+CHUNK_SIZE = 64 * 1024
+# directory entries per output chunk
+PAGE_SIZE = 1000
+# seconds between lookups of the paths of a command that waits for the image to load
+LOAD_POLL_INTERVAL = 0.01
+# completion candidates returned at most, the common prefix still covers every match
+MAX_COMPLETIONS = 1000
+# characters that end the word being completed
+WORD_BREAKS = " \t;&|<>"
+# a yyyy-mm date for cal, the width of a rendered month, and the months cal shows side by side and at most
+MONTH = re.compile(r"(\d{4})-(\d{1,2})")
+MONTH_WIDTH = 20
+MONTHS_PER_ROW = 3
+MAX_MONTHS = 1200
+
+
+def _nonprinting(byte: int) -> str:
+    prefix = ""
+    if byte >= 128:
+        prefix, byte = "M-", byte - 128
+    if byte < 32:
+        return prefix + "^" + chr(byte + 64)
+    if byte == 127:
+        return prefix + "^?"
+    return prefix + chr(byte)
+
+
+# cat -v: ^ and M- notation for every byte except LFD, TAB and printable ASCII
+NONPRINTING = {byte: _nonprinting(byte) for byte in range(256) if byte not in (9, 10) and not 32 <= byte < 127}
+
+
+def split_line(line: str) -> list:
+    """(command, operator after it) pairs of a command line split at unquoted ;, &&, ||, |, > and >>.
+
+    The commands keep their quoting, the operator of the last command is "". The part after > or >> is the target
+    of the redirection.
+    """
+    commands = []
+    start = 0
+    quote = None
+    i = 0
+    while i < len(line):
+        char = line[i]
+        if quote is not None:
+            if char == quote:
+                quote = None
+            elif char == "\\" and quote == '"':
+                i += 1
+        elif char in "'\"":
+            quote = char
+        elif char == "\\":
+            i += 1
+        elif char in ";&|>":
+            operator = line[i:i + 2] if line[i:i + 2] in ("&&", "||", ">>") else char
+            if operator != "&":
+                commands.append((line[start:i], operator))
+                i += len(operator)
+                start = i
+                continue
+        i += 1
+    commands.append((line[start:], ""))
+    return commands
+
+
+def split_lines(chunks: Iterator[str]) -> Iterator[str]:
+    """Lines of streamed text, without their line breaks."""
+    pending = []
+    for chunk in chunks:
+        start = 0
+        end = chunk.find("\n")
+        while end >= 0:
+            pending.append(chunk[start:end])
+            yield "".join(pending)
+            pending = []
+            start = end + 1
+            end = chunk.find("\n", start)
+        if start < len(chunk):
+            pending.append(chunk[start:])
+    if pending:
+        yield "".join(pending)
+
+
+def read_config(path: str = "config.yaml") -> dict:
+    with open(path) as file:
+        return yaml.safe_load(file)
+
+
+def load_system(config: dict) -> FileSystem:
+    """Start loading the image named in the config, the returned tree is filled in the background."""
+    system = FileSystem()
+    system.load_async(restore, system, config["system_directory"], config.get("lazy_content", True))
+    return system
+
+
+def restore(system: FileSystem, paths: str | List[str], lazy: bool):
+    # imported on the loading thread: tarfile and hashlib load while the prompt is already shown
+    import layers
+
+    layers.restore(system, paths, lazy)
+
+
+def open_logger(config: dict) -> AuditLogger:
+    return AuditLogger(config["log_file"], config.get("log_batch_size", 64), config.get("log_flush_interval", 1.0),
+                       config.get("log_max_bytes", 0), config.get("log_backup_count", 3),
+                       config.get("log_queue_size", 4096))
+
+
+def parse_month(text: str) -> Tuple[int, int] | None:
+    """(year, month) of a yyyy-mm date, None if it is not one."""
+    match = MONTH.fullmatch(text.strip())
+    if match is None:
+        return None
+    year, month = int(match[1]), int(match[2])
+    return (year, month) if 1 <= year <= 9999 and 1 <= month <= 12 else None
+
+
+def add_months(year: int, month: int, count: int) -> Tuple[int, int]:
+    year, month = divmod(year * 12 + month - 1 + count, 12)
+    return year, month + 1
+
+
+def prefixed(names: List[str], prefix: str) -> range:
+    """Indexes of the sorted names that start with prefix."""
+    start = bisect.bisect_left(names, prefix)
+    if not prefix:
+        return range(start, len(names))
+    # every name with the prefix sorts before the prefix with its last character incremented
+    return range(start, bisect.bisect_left(names, prefix[:-1] + chr(ord(prefix[-1]) + 1), start))
 
 
 class Shell(cmd.Cmd):
-    def __init__(self):
+    def __init__(self, config: dict | None = None, system: FileSystem | None = None,
+                 logger: AuditLogger | None = None):
+        """A shell session, on its own image or on a tree and audit log shared with other sessions."""
         super().__init__()
 
-        with open("config.yaml") as file:
-            config = yaml.safe_load(file)
+        config = read_config() if config is None else config
 
+        self.config = config
         self.intro = 'Welcome to GPU Shell Emulator. Type "help" for available commands.'
         self.username = config["username"]
         self.hostname = config["hostname"]
 
-        self.system = FileSystem()
-        self.system.fill(tarfile.open(config["system_directory"]))
+        # the prompt is shown right away, commands that need the tree wait for the load to finish
+        self.system = load_system(config) if system is None else system
 
-        self.log_file = open(config["log_file"], "w", newline="")
-        self.log_writer = csv.writer(self.log_file, delimiter=";")
+        self.logger = open_logger(config) if logger is None else logger
+        # changes made by this session, the tree itself may be shared and is never modified
+        self.overlay = Overlay(self.system, config.get("path_cache_size", 1024), config.get("listing_cache_size", 64))
+        # directory -> [version, children sorted by name, long-format rows, size width] for ls
+        self.listings = LRUCache(config.get("listing_cache_size", 64))
+        # (year, month, first weekday) -> rendered month, month 0 for a whole year
+        self.calendars = LRUCache(config.get("calendar_cache_size", 256))
+        self.first_weekday = config.get("first_weekday", 6)
+        # sorted command names, for completion
+        self.commands: List[str] | None = None
 
         self.current_directory_object = self.system
         self.current_directory = self.current_directory_object.abspath
         self.prompt = self.update_prompt()
 
-        self.parsers = self.generate_parsers()
+        # built on first use, one set per session
+        self.parsers = Parsers()
+
+        # set from another thread (Ctrl+C in the GUI) to stop the running command at its next checkpoint
+        self.cancelled = threading.Event()
+
+        # per-command timings of the phases of running a command, off unless enabled
+        self.stats = Stats(config.get("stats", False))
+
+        # exit status of the last pipeline, non-zero if any of its commands failed
+        self.status = 0
+        # output of the previous pipeline stage while a command runs as a later stage
+        self.input: Iterator[str] | None = None
+        # whether the output of the command being started goes to another command or a file, like !isatty()
+        self.piped = False
+        # width of a line of output, ls lays names out in columns to fit it
+        self.columns = config.get("columns", 80)
+
+    def onecmd(self, line: str):
+        """Run a command line, output is produced lazily while it is consumed."""
+        self.cancelled.clear()
+        return self.stats.line(self.execute(line))
+
+    def execute(self, line: str) -> Iterator[str]:
+        """Output of a command line made of commands joined by ;, &&, || and |, with > and >> redirections."""
+        parts = split_line(line)
+        pipeline = []
+        redirect = None
+        run = True
+        written = False
+        i = 0
+        while i < len(parts):
+            command, operator = parts[i]
+            i += 1
+            if command.strip():
+                pipeline.append(command)
+            while operator in (">", ">>") and i < len(parts):
+                # the output of the whole pipeline goes to the last target
+                target, next_operator = parts[i]
+                i += 1
+                redirect = (target, operator == ">>")
+                operator = next_operator
+            if operator == "|":
+                continue
+            if run and pipeline:
+                self.status = 0
+                separator = "\n" if written else ""
+                output = self.pipe(pipeline, redirect is not None)
+                if redirect is not None:
+                    output = self.redirect(output, *redirect)
+                for chunk in output:
+                    if chunk:
+                        yield separator + chunk
+                        separator = ""
+                        written = True
+                if self.cancelled.is_set():
+                    return
+            pipeline = []
+            redirect = None
+            if operator == "&&":
+                run = self.status == 0
+            elif operator == "||":
+                run = self.status != 0
+            else:
+                run = True
+
+    def pipe(self, commands: list, redirected: bool = False) -> Iterator[str]:
+        """Output of the last command, each command reads the streamed output of the one before it."""
+        output = None
+        for i, command in enumerate(commands):
+            self.input = self.stream(output) if output is not None else None
+            self.piped = redirected or i < len(commands) - 1
+            try:
+                output = self.command(command)
+            finally:
+                self.input = None
+                self.piped = False
+        return self.stream(output)
+
+    def redirect(self, output: Iterator[str], target: str, append: bool) -> Iterator[str]:
+        """Write the output of a pipeline to a file instead, yields error messages only."""
+        try:
+            words = shlex.split(target)
+        except ValueError as e:
+            yield self.fail(f"syntax error: {str(e).lower()}", 2)
+            return
+        if len(words) != 1:
+            yield self.fail(f"{target.strip()}: ambiguous redirect" if words
+                            else "syntax error near unexpected token `newline'", 1 if words else 2)
+            return
+        path = words[0]
+        directory, name = self.locate(path)
+        if directory is None:
+            yield self.fail(f"{path}: No such file or directory")
+            return
+        node = self.overlay.child(directory, name) if name else directory
+        if node is not None and node.isdir():
+            yield self.fail(f"{path}: Is a directory")
+            return
+        chunks = [chunk.encode("utf-8", "surrogateescape") for chunk in output if chunk]
+        # output ends without a line break unless it is copied from a file that has one, like cat a > b
+        if chunks and not chunks[-1].endswith(b"\n"):
+            chunks.append(b"\n")
+        self.overlay.write(directory, name, b"".join(chunks), append)
+
+    def command(self, line: str):
+        """Run a single command and return its output."""
+        name, args, _ = self.parseline(line)
+        name = name or ""
+        self.stats.command = name
+        if name:
+            # every command is audited here, once, whatever it does with its arguments
+            self.log(name, args or "NoArgs")
+        try:
+            return self.stats.timed(name, super().onecmd(line))
+        except CommandCancelled:
+            self.status = 130
+            return "^C"
+        except Exception as e:
+            # a failing command ends with an error status like any other, the rest of the line still runs
+            return self.fail(f"{name}: {e}" if name else str(e))
+
+    def fail(self, message: str, status: int = 1) -> str:
+        """Record that the running command failed and return its error message."""
+        self.status = status
+        return message
+
+    def postcmd(self, stop, line: str):
+        # commands return their output, print it here instead of treating it as the stop flag of cmdloop
+        written = False
+        for chunk in self.stream(stop):
+            self.stdout.write(chunk)
+            written = True
+        if written:
+            self.stdout.write("\n")
+        return False
+
+    def stream(self, output) -> Iterator[str]:
+        """Yield the output of a command as text chunks, stops with "^C" once the command is cancelled."""
+        if output is None:
+            return
+        if isinstance(output, str):
+            yield output
+            return
+        written = False
+        try:
+            for chunk in output:
+                self.check_cancelled()
+                yield chunk
+                written = written or bool(chunk)
+        except CommandCancelled:
+            self.status = 130
+            yield "^C"
+        except Exception as e:
+            # raised while the output was being produced, the message goes on a line of its own
+            yield ("\n" if written else "") + self.fail(str(e))
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise CommandCancelled()
+
+    def complete_line(self, line: str) -> Tuple[int, str, List[str]]:
+        """Completion of the last word of line: (start of the word, prefix common to every match, matches).
+
+        The first word of a command completes to command names, any other word to a path.
+        """
+        start = max(line.rfind(char) for char in WORD_BREAKS) + 1
+        before = line[:start].rstrip()
+        if not before or before[-1] in ";&|":
+            common, matches = self.complete_command(line[start:])
+        else:
+            common, matches = self.complete_path(line[start:])
+        return start, common, matches
+
+    def complete_command(self, prefix: str) -> Tuple[str, List[str]]:
+        if self.commands is None:
+            self.commands = sorted(name[3:] for name in self.get_names() if name.startswith("do_"))
+        found = prefixed(self.commands, prefix)
+        if not found:
+            return prefix, []
+        matches = self.commands[found.start:found.stop]
+        return os.path.commonprefix([matches[0], matches[-1]]), matches
+
+    def complete_path(self, text: str) -> Tuple[str, List[str]]:
+        """Paths that complete text, directories with a trailing /, at most MAX_COMPLETIONS of them."""
+        if not self.system.ready.is_set():
+            # never wait for the load in the middle of typing
+            return text, []
+        head, slash, prefix = text.rpartition("/")
+        directory = self.resolve(head + slash if slash else ".")
+        if directory is None or not directory.isdir():
+            return text, []
+        names = self.overlay.listing(directory)
+        found = prefixed(names, prefix)
+        if not found:
+            return text, []
+        head += slash
+        matches = [head + names[i] + ("/" if self.overlay.child(directory, names[i]).isdir() else "")
+                   for i in found[:MAX_COMPLETIONS]]
+        if len(found) == 1:
+            return matches[0], matches
+        return head + os.path.commonprefix([names[found[0]], names[found[-1]]]), matches
+
+    def completenames(self, text: str, *ignored) -> List[str]:
+        return self.complete_command(text)[1]
+
+    def completedefault(self, text: str, line: str, begidx: int, endidx: int) -> List[str]:
+        start, _, matches = self.complete_line(line[:endidx])
+        # readline replaces only the text after its own word break
+        return [match[max(begidx - start, 0):] for match in matches]
+
+    def parse(self, command: str, args: str):
+        """Arguments of a command parsed by its parser, raises ArgumentError."""
+        with self.stats.phase("parse"):
+            try:
+                words = shlex.split(args)
+            except ValueError as e:
+                raise ArgumentError(f"{command}: {e}")
+            return self.parsers[command].parse_args(words)
+
+    def wait_unless_loaded(self, paths: list, directories: bool = False):
+        """Wait until every path names a file (a directory) the running load will not change, or until it is done.
+
+        Lookups bypass the path cache while the image loads, it would keep a path the load has not reached yet as
+        missing.
+        """
+        while not self.system.ready.is_set():
+            if self.system.early and paths and all(self.loaded(path, directories) for path in paths):
+                return
+            self.check_cancelled()
+            self.system.ready.wait(LOAD_POLL_INTERVAL)
+        self.system.wait()
+
+    def loaded(self, path: str, directory: bool) -> bool:
+        node = self.current_directory_object.search_by_coord(path, self.overlay.child, self.overlay.parent)
+        return node is not None and node.isdir() == directory
+
+    def resolve(self, path: str):
+        """Node at path from the current directory, as changed by this session."""
+        with self.stats.phase("resolve"):
+            return self.overlay.resolve(self.current_directory_object, path)
+
+    def locate(self, path: str) -> tuple:
+        """(parent directory, name) of the node path names, whether it exists or not.
+
+        The directory is None if it does not exist, the name is empty for paths like / or . that name no entry.
+        """
+        head, _, name = path.rstrip("/").rpartition("/")
+        if name in ("", ".", ".."):
+            return self.resolve(path), ""
+        directory = self.resolve(head if head else "/" if path.startswith("/") else ".")
+        if directory is None or not directory.isdir():
+            return None, name
+        return directory, name
+
+    def log(self, command: str, args):
+        with self.stats.phase("log"):
+            self.logger.log(self.username, command, args)
 
     def update_prompt(self):
         return f"{self.username}@{self.hostname}:{self.current_directory}$ "
 
-    def generate_parsers(self):
-        parsers = dict()
-
-        parsers["pwd"] = ArgumentParser(
-            prog="pwd",
-            description="Print the name of the current working directory.",
-            add_help=False,
-            exit_on_error=False
-        )
-        parsers["pwd"].add_argument("--help", action=_HelpAction, help="show this help message and exit")
-
-        parsers["cat"] = ArgumentParser(
-            prog="cat",
-            description="Concatenate FILE(s) to standard output.",
-            add_help=False
-        )
-        parsers["cat"].add_argument("-l", action="store_true", help="use a long listing format")
-        parsers["cat"].add_argument("--help", action=_HelpAction, help="show this help message and exit")
-        parsers["cat"].add_argument("files", type=str, nargs="*", metavar="FILE")
-
-        parsers["ls"] = ArgumentParser(
-            prog="ls",
-            description="List information about the FILEs (the current directory by default).",
-            add_help=False
-        )
-        parsers["ls"].add_argument("-l", action="store_true", help="use a long listing format")
-        parsers["ls"].add_argument("--help", action=_HelpAction, help="show this help message and exit")
-        parsers["ls"].add_argument("files", type=str, nargs="*", metavar="FILE")
-
-        parsers["cd"] = ArgumentParser(
-            prog="cd",
-            description="Change the shell working directory.",
-            add_help=False
-        )
-        parsers["cd"].add_argument("--help", action=_HelpAction, help="show this help message and exit")
-        parsers["cd"].add_argument("dir", type=str, nargs="*")
-
-        parsers["exit"] = ArgumentParser(
-            prog="exit",
-            description="Exit the shell with a status of N.",
-            add_help=False
-        )
-        parsers["exit"].add_argument("--help", action=_HelpAction, help="show this help message and exit")
-        parsers["exit"].add_argument("status", type=str, nargs="*", metavar="N", default=0)
-
-        parsers["echo"] = ArgumentParser(
-            prog="echo",
-            description="Echo the STRING(s) to standard output.",
-            add_help=False
-        )
-        parsers["echo"].add_argument("--help", action=_HelpAction, help="show this help message and exit")
-        parsers["echo"].add_argument("strings", type=str, nargs="*", metavar="arg", default=[""])
-
-        parsers["cal"] = ArgumentParser(
-            prog="cal",
-            description="Displays a calendar.",
-            add_help=False
-        )
-        parsers["cal"].add_argument("--help", action=_HelpAction, help="show this help message and exit")
-        parsers["cal"].add_argument("-d", type=str, nargs="?", metavar="yyyy-mm")
-        parsers["cal"].add_argument("-y", type=int, nargs="?", metavar="yyyy")
-
-        return parsers
-
     def default(self, line: str):
-        return f"{line}: command not found"
+        return self.fail(f"{line}: command not found", 127)
 
     def do_help(self, arg):
         """
@@ -119,7 +464,7 @@ class Shell(cmd.Cmd):
                     return f'No help on {arg}'
 
             # If the parser exists, print its usage
-            if self.parsers[arg]:
+            if arg in self.parsers:
                 return self.parsers[arg].format_help()
             else:
                 # Otherwise, print the docstring for the method
@@ -132,161 +477,676 @@ class Shell(cmd.Cmd):
     def do_pwd(self, args: str):
         """Print the name of the current working directory."""
         try:
-            args = self.parsers["pwd"].parse_args(shlex.split(args))
+            args = self.parse("pwd", args)
         except ArgumentError as e:
-            return e.args[0]
+            return self.fail(e.args[0], 2)
 
         if not args.help:
-            self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "pwd", "NoArgs"])
             return self.current_directory
         else:
-            self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "pwd", "--help"])
             return self.parsers["pwd"].format_help()
 
     def do_cat(self, args: str):
         """Concatenate FILE(s) to standard output."""
         try:
-            args = self.parsers["cat"].parse_args(shlex.split(args))
+            args = self.parse("cat", args)
         except ArgumentError as e:
-            return e.args[0]
+            return self.fail(e.args[0], 2)
 
         if not args.help:
-            self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "cat", args])
+            self.wait_unless_loaded(args.files)
             if args.files:
-                for path in args.files:
-                    found = self.current_directory_object.search_by_coord(path)
-                    if found is None:
-                        return f"cat: {path}: No such file or directory"
-                    elif found.isfile():
-                        if found.extension == ".txt":
-                            return found.content.decode()
-                        else:
-                            return found.content
-                    else:
-                        return f"cat: {path}: Is a directory"
+                return self.concatenate(args.files, args.show_nonprinting, args.head, args.tail)
+            if self.input is not None:
+                return self.read_input(self.input, args.show_nonprinting)
         else:
-            self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "cat", "--help"])
             return self.parsers["cat"].format_help()
 
     def do_ls(self, args: str):
         """List information about the FILEs (the current directory by default)."""
         try:
-            args = self.parsers["ls"].parse_args(shlex.split(args))
+            args = self.parse("ls", args)
         except ArgumentError as e:
-            return e.args[0]
+            return self.fail(e.args[0], 2)
 
         if not args.help:
-            self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "ls", args])
-            if args.files:
-                for path in args.files:
-                    found = self.current_directory_object.search_by_coord(path)
-                    if found is None:
-                        return f"ls: cannot access '{path}': No such file or directory."
-                    elif found.isfile():
-                        return path
-                    else:
-                        if len(args.files) > 1:
-                            return f"{path}:"
-                        if args.l:
-                            data = [[child.size, child.mtime.strftime("%b %d %H:%M:%S"), child.name]
-                                    for child in found.children]
-                            return tabulate(data, tablefmt="plain")
-                        else:
-                            data = [child.name for child in found.children]
-                            return " ".join(data)
+            self.wait_unless_loaded(args.files)
+            # names go in columns unless the output is piped or redirected
+            columns = 1 if args.one or self.piped else self.columns
+            return self.paginate(self.ls(args, columns))
+        else:
+            return self.parsers["ls"].format_help()
+
+    def concatenate(self, paths: list, show_nonprinting: bool = False, head: int | None = None,
+                    tail: int | None = None) -> Iterator[str]:
+        at_line_start = True
+        after_error = False
+        for path in paths:
+            found = self.resolve(path)
+            if found is None or found.isdir():
+                error = "No such file or directory" if found is None else "Is a directory"
+                yield ("" if at_line_start else "\n") + self.fail(f"cat: {path}: {error}")
+                at_line_start, after_error = False, True
+                continue
+            start = max(found.size - tail, 0) if tail is not None else 0
+            for text in self.read_file(found, show_nonprinting, start, head):
+                if not text:
+                    continue
+                if after_error:
+                    text = "\n" + text
+                    after_error = False
+                yield text
+                at_line_start = text.endswith("\n")
+
+    def read_file(self, file, show_nonprinting: bool = False, start: int = 0,
+                  stop: int | None = None) -> Iterator[str]:
+        if show_nonprinting:
+            for chunk in file.chunks(CHUNK_SIZE, start, stop):
+                yield str(chunk, "latin-1").translate(NONPRINTING)
+            return
+        # incremental decoding keeps multibyte characters split between chunks intact
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        for chunk in file.chunks(CHUNK_SIZE, start, stop):
+            yield decoder.decode(chunk)
+        yield decoder.decode(b"", final=True)
+
+    def read_input(self, chunks: Iterator[str], show_nonprinting: bool = False) -> Iterator[str]:
+        """Output of the previous pipeline stage, passed through unless it is shown with ^ and M- notation."""
+        if not show_nonprinting:
+            return chunks
+        return (str(chunk.encode("utf-8", "replace"), "latin-1").translate(NONPRINTING) for chunk in chunks)
+
+    def ls(self, args, columns: int) -> Iterator[str]:
+        """Lines listing the files named, then each directory named, with its subdirectories after it with -R."""
+        files, directories = [], []
+        for path in args.files or ["."]:
+            found = self.resolve(path)
+            if found is None:
+                yield self.fail(f"ls: cannot access '{path}': No such file or directory", 2)
+            elif found.isdir():
+                directories.append((path, found, None))
             else:
+                files.append((path, found, None))
+        if files:
+            files.sort(key=itemgetter(0))
+            if args.l:
+                nodes = [node for _, node, _ in files]
+                sizes = self.overlay.sizes(nodes)
+                rows = self.format_rows([path for path, _, _ in files], nodes, sizes, len(str(max(sizes))))
+                files = [(path, node, row) for (path, node, _), row in zip(files, rows)]
+            files = self.sort_entries(files, args.sort)
+            yield from self.format_entries(files[::-1] if args.reverse else files, args, columns)
+        headers = len(args.files) > 1 or args.recursive
+        first = not files
+        directories.sort(key=itemgetter(0))
+        directories = self.sort_entries(directories, args.sort)
+        stack = directories if args.reverse else directories[::-1]
+        while stack:
+            path, directory, _ = stack.pop()
+            if not first:
+                yield ""
+            first = False
+            if headers:
+                yield f"{path}:"
+            entries = self.directory_entries(directory, args)
+            yield from self.format_entries(entries, args, columns)
+            if args.recursive:
+                stack.extend(reversed([(path.rstrip("/") + "/" + name, node, None) for name, node, _ in entries
+                                       if node.isdir() and name not in (".", "..")]))
+
+    def directory_entries(self, directory, args) -> list:
+        """(name, node, long-format row) of the entries of directory in listing order."""
+        entries, visible, width = self.cached_entries(directory, args.l, args.sort)
+        if args.all:
+            parent = self.overlay.parent(directory) or directory
+            names, nodes = [".", ".."], [directory, parent]
+            rows = self.format_rows(names, nodes, self.overlay.sizes(nodes), width) if args.l else [None, None]
+            entries = self.sort_entries(list(zip(names, nodes, rows)) + entries, args.sort)
+        else:
+            entries = visible
+        return entries[::-1] if args.reverse else entries
+
+    def cached_entries(self, directory, long: bool, sort: str) -> Tuple[list, list, int]:
+        """All entries of directory, those not starting with a dot, and the width of sizes in long rows.
+
+        Kept per directory and order until the mtime of the directory or the tree changes, the rows of a long
+        listing are formatted once and shared by every order.
+        """
+        version = (self.system.generation, self.overlay.generation, self.overlay.timestamp(directory))
+        key = (directory, long, sort)
+        cached = self.listings.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1:]
+        if sort != "name":
+            entries, _, width = self.cached_entries(directory, long, "name")
+            entries = self.sort_entries(entries, sort)
+        else:
+            children = sorted(self.overlay.children(directory), key=attrgetter("name"))
+            names = [child.name for child in children]
+            width = 0
+            rows = itertools.repeat(None)
+            if long:
+                sizes = self.overlay.sizes(children)
+                # . and .. are sized along with the children
+                parent = self.overlay.parent(directory) or directory
+                width = len(str(max(sizes + self.overlay.sizes((directory, parent)))))
+                rows = self.format_rows(names, children, sizes, width)
+            entries = list(zip(names, children, rows))
+        visible = [entry for entry in entries if not entry[0].startswith(".")]
+        cached = (version, entries, visible if len(visible) < len(entries) else entries, width)
+        self.listings.put(key, cached)
+        return cached[1:]
+
+    def sort_entries(self, entries: list, sort: str) -> list:
+        """Entries in name order sorted by size or time instead, ties stay in name order."""
+        if sort == "name":
+            return entries
+        nodes = [node for _, node, _ in entries]
+        keys = self.overlay.sizes(nodes) if sort == "size" else self.overlay.timestamps(nodes)
+        # largest or newest first, a reversed sort is still stable
+        return [entry for _, entry in sorted(zip(keys, entries), key=itemgetter(0), reverse=True)]
+
+    def format_entries(self, entries: list, args, columns: int) -> Iterator[str]:
+        if args.l:
+            yield from map(itemgetter(2), entries)
+        else:
+            yield from self.columnate([name for name, _, _ in entries], columns)
+
+    def format_rows(self, names: List[str], nodes: list, sizes: List[int], width: int) -> List[str]:
+        """Long-format rows of nodes shown under names, sizes right-aligned to width."""
+        # nodes of a directory often share mtimes, each is formatted once
+        timestamps = self.overlay.timestamps(nodes)
+        times = {timestamp: f"{datetime.fromtimestamp(timestamp):%b %d %H:%M:%S}" for timestamp in set(timestamps)}
+        return [f"{size:>{width}}  {times[timestamp]}  {name}"
+                for name, size, timestamp in zip(names, sizes, timestamps)]
+
+    @staticmethod
+    def columnate(names: List[str], columns: int) -> Iterator[str]:
+        """Lines of names laid out down then across in columns that fit a line of that many characters."""
+        if columns <= 1:
+            yield from names
+            return
+        width = max(map(len, names), default=0) + 2
+        across = max(min(columns // width, len(names)), 1)
+        rows = -(-len(names) // across)
+        padded = [name.ljust(width) for name in names]
+        for row in range(rows):
+            line = padded[row::rows]
+            # no padding after the last name of a line
+            line[-1] = names[row + (len(line) - 1) * rows]
+            yield "".join(line)
+
+    def do_find(self, args: str):
+        """Search for files in a directory hierarchy."""
+        try:
+            args = self.parse("find", args)
+        except ArgumentError as e:
+            return self.fail(e.args[0], 2)
+
+        if not args.help:
+            self.system.wait()
+            try:
+                if args.size is not None:
+                    search.size_test(args.size)
+                if args.mtime is not None:
+                    search.mtime_test(args.mtime)
+            except ValueError as e:
+                return self.fail(f"find: {e}")
+            return self.paginate(self.find(args))
+        else:
+            return self.parsers["find"].format_help()
+
+    def find(self, args) -> Iterator[str]:
+        name = args.iname if args.iname is not None else args.name
+        for path in args.paths:
+            start = self.resolve(path)
+            if start is None:
+                yield self.fail(f"find: '{path}': No such file or directory")
+                continue
+            for node in search.find(self.system, start, name, args.iname is not None, args.type, args.size,
+                                    args.mtime, self.overlay):
+                yield self.display_path(path, start, node)
+
+    def do_grep(self, args: str):
+        """Search for PATTERN in each FILE."""
+        try:
+            args = self.parse("grep", args)
+        except ArgumentError as e:
+            return self.fail(e.args[0], 2)
+
+        if not args.help:
+            self.system.wait()
+            try:
+                regex = re.compile(args.pattern, re.MULTILINE | (re.IGNORECASE if args.i else 0))
+            except re.error as e:
+                return self.fail(f"grep: {e}", 2)
+            files = args.files or (["."] if args.r else [])
+            if files:
+                return self.paginate(self.grep(args, regex, files))
+            if self.input is not None:
+                return self.paginate(self.grep_input(args, regex, self.input))
+        else:
+            return self.parsers["grep"].format_help()
+
+    def grep(self, args, regex: re.Pattern, paths: list) -> Iterator[str]:
+        # multiprocessing is slow to import, only commands that may start a pool load it
+        import parallel
+
+        # the content index only covers the base tree, and is only worth building for recursive searches
+        candidates = search.grep_candidates(self.system, args.pattern, args.i) \
+            if args.r and self.overlay.clean else None
+        show_names = args.r or len(paths) > 1
+        matched = False
+        items = self.collect_files("grep", paths, args.r, candidates)
+        results = parallel.grep([item[1] for item in items if not isinstance(item, str)], regex,
+                                self.config.get("workers"))
+        for item in items:
+            if isinstance(item, str):
+                yield item
+                continue
+            name = item[0]
+            for line_number, line in next(results):
+                matched = True
                 if args.l:
-                    data = [[child.size, child.mtime.strftime("%b %d %H:%M:%S"), child.name]
-                            for child in self.current_directory_object.children]
-                    return tabulate(data, tablefmt="plain")
+                    yield name
+                    break
+                prefix = (f"{name}:" if show_names else "") + (f"{line_number}:" if args.n else "")
+                yield prefix + line
+        if not matched and self.status == 0:
+            self.status = 1
+
+    def grep_input(self, args, regex: re.Pattern, chunks: Iterator[str]) -> Iterator[str]:
+        """grep over the lines of the previous pipeline stage."""
+        matched = False
+        for line_number, line in enumerate(split_lines(chunks), 1):
+            if regex.search(line) is None:
+                continue
+            matched = True
+            if args.l:
+                yield "(standard input)"
+                break
+            yield (f"{line_number}:" if args.n else "") + line
+        if not matched and self.status == 0:
+            self.status = 1
+
+    def do_md5sum(self, args: str):
+        """Print MD5 (128-bit) checksums."""
+        try:
+            args = self.parse("md5sum", args)
+        except ArgumentError as e:
+            return self.fail(e.args[0], 2)
+
+        if not args.help:
+            self.system.wait()
+            if args.files:
+                return self.paginate(self.md5sum(args.files, args.r))
+        else:
+            return self.parsers["md5sum"].format_help()
+
+    def md5sum(self, paths: list, recursive: bool) -> Iterator[str]:
+        import parallel
+
+        items = self.collect_files("md5sum", paths, recursive)
+        digests = parallel.md5([item[1] for item in items if not isinstance(item, str)], self.config.get("workers"))
+        for item in items:
+            yield item if isinstance(item, str) else f"{next(digests)}  {item[0]}"
+
+    def collect_files(self, command: str, paths: list, recursive: bool, candidates: set | None = None) -> list:
+        """Error messages and (display name, file) pairs for the FILE arguments of a command, in output order."""
+        items = []
+        for path in paths:
+            found = self.resolve(path)
+            if found is None:
+                items.append(self.fail(f"{command}: {path}: No such file or directory"))
+            elif found.isdir():
+                if not recursive:
+                    items.append(self.fail(f"{command}: {path}: Is a directory"))
+                    continue
+                for file in search.grep_files(self.system, found, candidates, self.overlay):
+                    items.append((self.display_path(path, found, file), file))
+            elif candidates is None or found in candidates:
+                items.append((path, found))
+        return items
+
+    def display_path(self, path: str, start, node) -> str:
+        """Path of a node below start, spelled relative to the argument that named start."""
+        if node is start:
+            return path
+        relative = self.overlay.path(node)[len(self.overlay.path(start)):].lstrip("/")
+        return path.rstrip("/") + "/" + relative
+
+    def paginate(self, lines: Iterator[str]) -> Iterator[str]:
+        lines = iter(lines)
+        first = True
+        while True:
+            page = list(itertools.islice(lines, PAGE_SIZE))
+            if not page:
+                return
+            yield ("" if first else "\n") + "\n".join(page)
+            first = False
+
+    def do_mkdir(self, args: str):
+        """Create the DIRECTORY(ies), if they do not already exist."""
+        try:
+            args = self.parse("mkdir", args)
+        except ArgumentError as e:
+            return self.fail(e.args[0], 2)
+
+        if not args.help:
+            self.system.wait()
+            if not args.dirs:
+                return self.fail("mkdir: missing operand", 2)
+            errors = [error for error in map(self.make_directory if not args.p else self.make_parents, args.dirs)
+                      if error is not None]
+            return "\n".join(errors) or None
+        else:
+            return self.parsers["mkdir"].format_help()
+
+    def make_directory(self, path: str) -> str | None:
+        directory, name = self.locate(path)
+        if directory is None:
+            return self.fail(f"mkdir: cannot create directory '{path}': No such file or directory")
+        if not name or self.overlay.child(directory, name) is not None:
+            return self.fail(f"mkdir: cannot create directory '{path}': File exists")
+        self.overlay.mkdir(directory, name)
+        return None
+
+    def make_parents(self, path: str) -> str | None:
+        node = self.system if path.startswith("/") else self.current_directory_object
+        for part in path.split("/"):
+            if part in ("", "."):
+                continue
+            if part == "..":
+                node = self.overlay.parent(node) or node
+                continue
+            child = self.overlay.child(node, part)
+            if child is None:
+                child = self.overlay.mkdir(node, part)
+            elif not child.isdir():
+                return self.fail(f"mkdir: cannot create directory '{path}': Not a directory")
+            node = child
+        return None
+
+    def do_touch(self, args: str):
+        """Update the modification time of each FILE to the current time."""
+        try:
+            args = self.parse("touch", args)
+        except ArgumentError as e:
+            return self.fail(e.args[0], 2)
+
+        if not args.help:
+            self.system.wait()
+            if not args.files:
+                return self.fail("touch: missing file operand", 2)
+            errors = []
+            for path in args.files:
+                directory, name = self.locate(path)
+                if directory is None:
+                    errors.append(self.fail(f"touch: cannot touch '{path}': No such file or directory"))
+                elif not name:
+                    self.overlay.stamp(directory)
                 else:
-                    data = [child.name for child in self.current_directory_object.children]
-                    return " ".join(data)
+                    self.overlay.touch(directory, name)
+            return "\n".join(errors) or None
         else:
-            self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "ls", "--help"])
-            return self.parsers["ls"].format_help()
+            return self.parsers["touch"].format_help()
+
+    def do_rm(self, args: str):
+        """Remove (unlink) the FILE(s)."""
+        try:
+            args = self.parse("rm", args)
+        except ArgumentError as e:
+            return self.fail(e.args[0], 2)
+
+        if not args.help:
+            self.system.wait()
+            if not args.files and not args.f:
+                return self.fail("rm: missing operand", 2)
+            errors = []
+            for path in args.files:
+                directory, name = self.locate(path)
+                node = self.overlay.child(directory, name) if directory is not None and name else None
+                if directory is not None and not name:
+                    errors.append(self.fail(f"rm: refusing to remove '.' or '..' directory: skipping '{path}'"
+                                            if path.strip("/") else "rm: refusing to remove '/'"))
+                elif node is None:
+                    if not args.f:
+                        errors.append(self.fail(f"rm: cannot remove '{path}': No such file or directory"))
+                elif node.isdir() and not args.r:
+                    errors.append(self.fail(f"rm: cannot remove '{path}': Is a directory"))
+                else:
+                    self.overlay.remove(directory, name)
+            return "\n".join(errors) or None
+        else:
+            return self.parsers["rm"].format_help()
+
+    def do_mv(self, args: str):
+        """Rename SOURCE to DEST, or move SOURCE(s) to DIRECTORY."""
+        try:
+            args = self.parse("mv", args)
+        except ArgumentError as e:
+            return self.fail(e.args[0], 2)
+
+        if not args.help:
+            self.system.wait()
+            if len(args.files) < 2:
+                return self.fail("mv: missing file operand" if not args.files
+                                 else f"mv: missing destination file operand after '{args.files[0]}'", 2)
+            *sources, destination = args.files
+            target = self.resolve(destination)
+            if (target is None or not target.isdir()) and len(sources) > 1:
+                return self.fail(f"mv: target '{destination}' is not a directory")
+            errors = []
+            for path in sources:
+                error = self.move(path, destination, target)
+                if error is not None:
+                    errors.append(self.fail(error))
+            # the working directory or one of its ancestors may have moved
+            self.current_directory_object = self.overlay.current(self.current_directory_object)
+            self.current_directory = self.overlay.path(self.current_directory_object)
+            self.prompt = self.update_prompt()
+            return "\n".join(errors) or None
+        else:
+            return self.parsers["mv"].format_help()
+
+    def move(self, path: str, destination: str, target) -> str | None:
+        """Move the node at path to destination, target is the node destination names, if any."""
+        directory, name = self.locate(path)
+        node = self.overlay.child(directory, name) if directory is not None and name else None
+        if node is None:
+            return f"mv: cannot stat '{path}': No such file or directory" if directory is None or name \
+                else f"mv: cannot move '{path}': Device or resource busy"
+        if target is not None and target.isdir():
+            directory, name = target, node.name
+        else:
+            directory, name = self.locate(destination)
+            if directory is None or not name:
+                return f"mv: cannot move '{path}' to '{destination}': No such file or directory"
+        existing = self.overlay.child(directory, name)
+        if existing is node:
+            return None
+        if node.isdir() and self.overlay.within(directory, node):
+            return f"mv: cannot move '{path}' to a subdirectory of itself, '{destination}'"
+        if existing is not None and existing.isdir() and not node.isdir():
+            return f"mv: cannot overwrite directory '{destination}' with non-directory"
+        if existing is not None and not existing.isdir() and node.isdir():
+            return f"mv: cannot overwrite non-directory '{destination}' with directory '{path}'"
+        if existing is not None and existing.isdir() and next(iter(self.overlay.children(existing)), None):
+            return f"mv: cannot move '{path}' to '{destination}': Directory not empty"
+        self.overlay.move(node, directory, name)
+        return None
+
+    def do_tar(self, args: str):
+        """Write the tree with this session's changes to a new archive."""
+        try:
+            args = self.parse("tar", args)
+        except ArgumentError as e:
+            return self.fail(e.args[0], 2)
+
+        if not args.help:
+            self.system.wait()
+            if not args.c:
+                return self.fail("tar: only archive creation (-c) is supported", 2)
+            if not args.f or os.path.basename(args.f) != args.f or args.f in (".", ".."):
+                return self.fail("tar: -f needs an archive file name, archives are written to the export directory",
+                                 2)
+            directory = self.resolve(args.dir)
+            if directory is None or not directory.isdir():
+                return self.fail(f"tar: {args.dir}: Cannot open: Not a directory" if directory is not None
+                                 else f"tar: {args.dir}: Cannot open: No such file or directory")
+            path = os.path.join(self.config.get("export_directory", "."), args.f)
+            return self.paginate(self.export(directory, path, args.v))
+        else:
+            return self.parsers["tar"].format_help()
+
+    def export(self, directory, path: str, verbose: bool) -> Iterator[str]:
+        """Stream the merged tree into the archive at path, replaced only once it is complete."""
+        import tarfile
+
+        partial = path + ".part"
+        try:
+            with tarfile.open(partial, "w") as tar:
+                for name in self.overlay.export(tar, directory):
+                    self.check_cancelled()
+                    if verbose:
+                        yield name
+            os.replace(partial, path)
+        except OSError as e:
+            yield self.fail(f"tar: {path}: {e.strerror}")
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
 
     def do_cd(self, args: str):
         """Change the shell working directory."""
         try:
-            args = self.parsers["cd"].parse_args(shlex.split(args))
+            args = self.parse("cd", args)
         except ArgumentError as e:
-            return e.args[0]
+            return self.fail(e.args[0], 2)
 
         if not args.help:
-            self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "cd", args.dir])
+            self.wait_unless_loaded(args.dir, directories=True)
             if len(args.dir) == 1:
-                result = self.current_directory_object.search_by_coord(args.dir[0])
+                result = self.resolve(args.dir[0])
                 if result is None:
-                    return f"cd: {args.dir[0]}: No such file or directory"
+                    return self.fail(f"cd: {args.dir[0]}: No such file or directory")
                 elif result.isfile():
-                    return f"cd: {args.dir[0]}: Not a directory"
+                    return self.fail(f"cd: {args.dir[0]}: Not a directory")
                 else:
                     self.current_directory_object = result
-                    self.current_directory = self.current_directory_object.abspath
+                    self.current_directory = self.overlay.path(result)
                 self.prompt = self.update_prompt()
             elif len(args.dir) > 1:
-                return "cd: too many arguments"
+                return self.fail("cd: too many arguments")
         else:
-            self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "cd", "--help"])
             return self.parsers["cd"].format_help()
 
     def do_exit(self, args: str):
         """Exit the shell."""
         try:
-            args = self.parsers["exit"].parse_args(shlex.split(args))
+            args = self.parse("exit", args)
         except ArgumentError as e:
-            return e.args[0]
+            return self.fail(e.args[0], 2)
 
         if not args.help:
             if len(args.status) > 1:
-                return "exit: too many arguments"
+                return self.fail("exit: too many arguments")
             else:
                 if args.status[0].isdigit():
                     args.status[0] = int(args.status[0])
-                self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "exit",
-                                          args.status[0]])
-                self.log_file.close()
+                # the log may be shared with other sessions, it is closed at interpreter exit
+                self.logger.flush()
                 exit(args.status[0])
         else:
-            self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "exit", "--help"])
             return self.parsers["exit"].format_help()
 
     def do_echo(self, args: str):
         """Write arguments to the standard output."""
         try:
-            args = self.parsers["echo"].parse_args(shlex.split(args))
+            args = self.parse("echo", args)
         except ArgumentError as e:
-            return e.args[0]
+            return self.fail(e.args[0], 2)
 
-        self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "echo", args.strings])
         return " ".join(args.strings)
 
+    def do_stats(self, args: str):
+        """Show how long the phases of running each command took."""
+        try:
+            args = self.parse("stats", args)
+        except ArgumentError as e:
+            return self.fail(e.args[0], 2)
+
+        if not args.help:
+            if args.action in ("on", "off"):
+                self.stats.enabled = args.action == "on"
+            elif args.action == "reset":
+                self.stats.reset()
+            elif args.json:
+                return json.dumps(self.stats.as_dict(), indent=2)
+            else:
+                return self.paginate(self.stats.table())
+        else:
+            return self.parsers["stats"].format_help()
+
     def do_cal(self, args: str):
         """Displays a calendar."""
         try:
-            args = self.parsers["cal"].parse_args(shlex.split(args))
+            args = self.parse("cal", args)
         except ArgumentError as e:
-            return e.args[0]
+            return self.fail(e.args[0], 2)
 
         date = datetime.now()
 
         if not args.help:
-            if args.d and re.match(r"\d{4}-{1,2}", args.d):
-                self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "cal", args.d])
-                year, month = list(map(int, args.d.split("-")))
-                return calendar.TextCalendar(6).formatmonth(year, month)
-            elif args.y:
-                self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "cal",
-                                          f"{args.y}"])
-                return calendar.TextCalendar(6).formatyear(args.y)
+            if args.range is not None:
+                first, separator, last = args.range.partition("..")
+                start = parse_month(first)
+                stop = parse_month(last) if separator else start
+                if start is None or stop is None:
+                    return self.fail(f"cal: invalid range '{args.range}', expected yyyy-mm..yyyy-mm")
+                count = (stop[0] - start[0]) * 12 + stop[1] - start[1] + 1
+                if not 1 <= count <= MAX_MONTHS:
+                    return self.fail(f"cal: a range spans 1 to {MAX_MONTHS} months")
+                return self.paginate(self.format_months([add_months(*start, i) for i in range(count)]))
+            elif args.y is not None:
+                year = date.year if args.y is CURRENT_YEAR else args.y
+                if not 1 <= year <= 9999:
+                    return self.fail(f"cal: year {year} not in range 1..9999")
+                return self.render_calendar(year, 0)
             else:
-                self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "cal", "NoArgs"])
-                return calendar.TextCalendar(6).formatmonth(date.year, date.month)
+                center = (date.year, date.month) if args.d is None else parse_month(args.d)
+                if center is None:
+                    return self.fail(f"cal: invalid date '{args.d}', expected yyyy-mm")
+                if not args.three:
+                    return self.render_calendar(*center)
+                months = [add_months(*center, i) for i in (-1, 0, 1)]
+                return self.paginate(self.format_months([month for month in months if 1 <= month[0] <= 9999]))
         else:
-            self.log_writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.username, "cal", "--help"])
             return self.parsers["cal"].format_help()
 
+    def render_calendar(self, year: int, month: int) -> str:
+        """A month, or the whole year for month 0, rendered once and kept in a bounded cache."""
+        key = (year, month, self.first_weekday)
+        text = self.calendars.get(key)
+        if text is None:
+            import calendar
+
+            renderer = calendar.TextCalendar(self.first_weekday)
+            text = renderer.formatmonth(year, month) if month else renderer.formatyear(year)
+            self.calendars.put(key, text)
+        return text
+
+    def format_months(self, months: List[Tuple[int, int]]) -> Iterator[str]:
+        """Lines of months shown side by side, MONTHS_PER_ROW to a row."""
+        for start in range(0, len(months), MONTHS_PER_ROW):
+            self.check_cancelled()
+            blocks = [self.render_calendar(*month).splitlines() for month in months[start:start + MONTHS_PER_ROW]]
+            if start:
+                yield ""
+            for i in range(max(map(len, blocks))):
+                yield "  ".join(block[i].ljust(MONTH_WIDTH) if i < len(block) else " " * MONTH_WIDTH
+                                for block in blocks).rstrip()
+
 
 if __name__ == "__main__":
     Shell().cmdloop()
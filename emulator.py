@@ -1,27 +1,134 @@
+from __future__ import annotations
+
 from PySide6.QtWidgets import QApplication, QPlainTextEdit
 from PySide6.QtGui import QTextCursor, QPalette, QTextCharFormat, QFont, QKeyEvent, QMouseEvent, QContextMenuEvent
-from PySide6.QtCore import Qt
-from console import Shell
+from PySide6.QtCore import Qt, QObject, QThread, QTimer, Signal, Slot
+from collections import deque
+from history import History
+from typing import TYPE_CHECKING
+import threading
+import time
+
+if TYPE_CHECKING:
+    from console import Shell
+    from stats import Profiler
+    from structs import FileSystem
+
+
+class CommandWorker(QObject):
+    """Runs shell commands on a worker thread and streams the output back through signals."""
+    output = Signal(str)
+    finished = Signal(str)
+    exited = Signal(object)
+
+    # output is sent in batches of up to BATCH_SIZE characters or every BATCH_INTERVAL seconds
+    BATCH_SIZE = 64 * 1024
+    BATCH_INTERVAL = 0.016
+    # batches sent but not drawn yet, the worker waits for the console beyond that
+    MAX_BATCHES = 8
+
+    def __init__(self, shell: Shell, profiler: Profiler | None = None):
+        super(CommandWorker, self).__init__()
+        self.shell = shell
+        self.profiler = profiler
+        self.credits = threading.Semaphore(self.MAX_BATCHES)
+
+    @Slot(str)
+    def execute(self, cmd: str):
+        if self.profiler is None:
+            self.run(cmd)
+            return
+        with self.profiler.thread():
+            self.run(cmd)
+
+    def run(self, cmd: str):
+        try:
+            batch = []
+            size = 0
+            sent = time.perf_counter()
+            for chunk in self.shell.stream(self.shell.onecmd(cmd)):
+                batch.append(chunk)
+                size += len(chunk)
+                if size >= self.BATCH_SIZE or time.perf_counter() - sent >= self.BATCH_INTERVAL:
+                    self.send("".join(batch))
+                    batch = []
+                    size = 0
+                    sent = time.perf_counter()
+            if batch:
+                self.send("".join(batch))
+        except SystemExit as e:
+            self.exited.emit(e.code)
+            return
+        except Exception as e:
+            # the console must get its prompt back whatever the command did
+            self.send(str(e) or type(e).__name__)
+        self.finished.emit(cmd)
+
+    def send(self, text: str):
+        if not text:
+            return
+        while not self.credits.acquire(timeout=0.1):
+            if self.shell.cancelled.is_set():
+                return
+        self.output.emit(text)
 
 
 class Console(QPlainTextEdit):
-    def __init__(self, parent=None):
+    execute = Signal(str)
+
+    # time spent drawing output per timer tick, in characters-sized slices
+    FRAME_BUDGET = 0.008
+    SLICE_SIZE = 4096
+
+    def __init__(self, parent=None, profiler: Profiler | None = None, config: dict | None = None,
+                 system: FileSystem | None = None):
+        """The console of a shell session, on an image whose load may have been started already."""
         super(Console, self).__init__(parent)
+        # imported here so that importing the widget does not pull in the shell
+        from console import Shell
 
         self.windowWidth = 0
         self.windowHeight = 0
 
-        self.console = Shell()
+        self.console = Shell(config, system)
         self.prompt = self.console.prompt
         self.insertPrompt()
 
-        self.history = []
-        self.historyPos = 0
+        self.history = History(self.console.config.get("history_file"), self.console.config.get("history_size", 10000))
+        # index into the history entries while browsing them, None on a new line
+        self.historyPos: int | None = None
+        # reverse-i-search state: the line it started from, the query and the (id, command) found
+        self.searching = False
+        self.searchLine = ""
+        self.searchQuery = ""
+        self.searchMatch: tuple | None = None
+        self.searchFailed = False
 
         self.buffer = QApplication.clipboard()
 
         self.isLocked = False
 
+        # output batches waiting to be drawn, appended on a timer so big outputs never stall the widget
+        self.pending = deque()
+        self.outputStarted = False
+        self.commandDone = False
+        # time spent drawing the output of the running command, recorded as its render phase
+        self.renderTime = 0.0
+        self.outputTimer = QTimer(self)
+        self.outputTimer.setInterval(16)
+        self.outputTimer.timeout.connect(self.flushOutput)
+        self.setMaximumBlockCount(self.console.config.get("scrollback", 10000))
+
+        self.workerThread = QThread(self)
+        self.worker = CommandWorker(self.console, profiler)
+        self.worker.moveToThread(self.workerThread)
+        self.execute.connect(self.worker.execute)
+        self.worker.output.connect(self.onOutput)
+        self.worker.finished.connect(self.onFinished)
+        self.worker.exited.connect(self.onExit)
+        QApplication.instance().aboutToQuit.connect(self.stopWorker)
+        self.workerThread.start()
+
         self.initUI()
 
     def initUI(self):
@@ -36,8 +143,21 @@ class Console(QPlainTextEdit):
         self.setPalette(p)
         self.setFont(QFont("Consolas", 12))
 
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        # ls fits its columns to the width of the widget
+        self.console.columns = max(self.viewport().width() // self.fontMetrics().horizontalAdvance(" "), 1)
+
     def keyPressEvent(self, event: QKeyEvent):
         if self.isLocked:
+            if event.key() == Qt.Key.Key_C and event.modifiers() == Qt.KeyboardModifier.ControlModifier:
+                self.console.cancel()
+            return
+        if self.searching:
+            self.searchKeyPress(event)
+            return
+        if event.key() == Qt.Key.Key_R and event.modifiers() == Qt.KeyboardModifier.ControlModifier:
+            self.searchStart()
             return
         if 32 <= event.key() <= 126 and (event.modifiers() == Qt.KeyboardModifier.NoModifier or event.modifiers() == Qt.KeyboardModifier.ShiftModifier):
             super().keyPressEvent(event)
@@ -46,6 +166,8 @@ class Console(QPlainTextEdit):
         if event.key() == Qt.Key.Key_Return and event.modifiers() == Qt.KeyboardModifier.NoModifier:
             cmd = self.textCursor().block().text()[len(self.prompt):]
             self.onEnter(cmd)
+        if event.key() == Qt.Key.Key_Tab and event.modifiers() == Qt.KeyboardModifier.NoModifier:
+            self.complete()
         if event.key() == Qt.Key.Key_Up and event.modifiers() == Qt.KeyboardModifier.NoModifier:
             self.historyBack()
         if event.key() == Qt.Key.Key_Down and event.modifiers() == Qt.KeyboardModifier.NoModifier:
@@ -68,13 +190,81 @@ class Console(QPlainTextEdit):
     def contextMenuEvent(self, event: QContextMenuEvent):
         pass
 
+    def complete(self):
+        from console import MAX_COMPLETIONS
+
+        cmd = self.textCursor().block().text()[len(self.prompt):]
+        start, common, matches = self.console.complete_line(cmd)
+        if not matches:
+            return
+        word = cmd[start:]
+        if len(matches) == 1 and not common.endswith("/"):
+            common += " "
+        if len(common) > len(word):
+            self.textCursor().insertText(common[len(word):])
+            return
+        # nothing to add, list the matches and repeat the line below them
+        cursor = self.textCursor()
+        cursor.insertBlock()
+        cursor.insertText("  ".join(matches) + ("  ..." if len(matches) == MAX_COMPLETIONS else ""))
+        self.insertPrompt(True)
+        self.textCursor().insertText(cmd)
+        self.scrollDown()
+
     def onEnter(self, cmd: str):
-        consoleOutput = self.console.onecmd(cmd)
-        if consoleOutput:
-            self.textCursor().insertBlock()
+        # the command runs on the worker thread, input stays locked until its output is drawn
+        self.isLocked = True
         self.historyAdd(cmd)
-        self.textCursor().insertText(consoleOutput)
-        self.insertPrompt(True)
+        self.outputStarted = False
+        self.commandDone = False
+        self.renderTime = 0.0
+        self.outputTimer.start()
+        self.execute.emit(cmd)
+
+    def onOutput(self, text: str):
+        self.pending.append(text)
+
+    def onFinished(self, cmd: str):
+        self.commandDone = True
+
+    def flushOutput(self):
+        if self.pending:
+            cursor = self.textCursor()
+            if not self.outputStarted:
+                cursor.insertBlock()
+                self.outputStarted = True
+            # draw slices until the frame budget is spent, the rest waits for the next tick
+            start = time.perf_counter()
+            while self.pending and time.perf_counter() - start < self.FRAME_BUDGET:
+                text = self.pending.popleft()
+                if len(text) > self.SLICE_SIZE:
+                    self.pending.appendleft(text[self.SLICE_SIZE:])
+                    text = text[:self.SLICE_SIZE]
+                else:
+                    self.worker.credits.release()
+                cursor.insertText(text)
+            self.scrollDown()
+            self.renderTime += time.perf_counter() - start
+        elif self.commandDone:
+            self.outputTimer.stop()
+            if self.outputStarted:
+                self.console.stats.record(self.console.stats.command, "render", self.renderTime)
+            self.insertPrompt(True)
+            self.isLocked = False
+
+    def onExit(self, status):
+        self.stopWorker()
+        QApplication.exit(status if isinstance(status, int) else 1)
+
+    def stopWorker(self):
+        self.history.close()
+        self.console.cancel()
+        self.workerThread.quit()
+        self.workerThread.wait()
+
+    def closeEvent(self, event):
+        self.stopWorker()
+        super().closeEvent(event)
 
     def insertPrompt(self, insertNewBlock: bool = False):
         self.prompt = self.console.update_prompt()
@@ -91,33 +281,88 @@ class Console(QPlainTextEdit):
         vbar = self.verticalScrollBar()
         vbar.setValue(vbar.maximum())
 
-    def historyAdd(self, cmd: str):
-        self.history.append(cmd)
-        self.historyPos = len(self.history)
-
-    def historyBack(self):
-        if not self.historyPos:
-            return
+    def replaceLine(self, text: str):
         cursor = self.textCursor()
         cursor.movePosition(QTextCursor.MoveOperation.StartOfBlock)
         cursor.movePosition(QTextCursor.MoveOperation.EndOfBlock, QTextCursor.MoveMode.KeepAnchor)
         cursor.removeSelectedText()
-        cursor.insertText(self.prompt + self.history[self.historyPos - 1])
+        cursor.insertText(text)
         self.setTextCursor(cursor)
-        self.historyPos -= 1
+
+    def historyAdd(self, cmd: str):
+        self.history.add(cmd)
+        self.historyPos = None
+
+    def historyBack(self):
+        entries = self.history.entries()
+        position = len(entries) if self.historyPos is None else self.historyPos
+        if not position:
+            return
+        self.replaceLine(self.prompt + entries[position - 1])
+        self.historyPos = position - 1
 
     def historyForward(self):
-        if self.historyPos == len(self.history):
+        if self.historyPos is None:
             return
-        cursor = self.textCursor()
-        cursor.movePosition(QTextCursor.MoveOperation.StartOfBlock)
-        cursor.movePosition(QTextCursor.MoveOperation.EndOfBlock, QTextCursor.MoveMode.KeepAnchor)
-        cursor.removeSelectedText()
-        if self.historyPos == len(self.history) - 1:
-            cursor.insertText(self.prompt)
+        entries = self.history.entries()
+        if self.historyPos >= len(entries) - 1:
+            self.replaceLine(self.prompt)
+            self.historyPos = None
         else:
-            cursor.insertText(self.prompt + self.history[self.historyPos + 1])
-        self.setTextCursor(cursor)
-        self.historyPos += 1
+            self.replaceLine(self.prompt + entries[self.historyPos + 1])
+            self.historyPos += 1
+
+    def searchStart(self):
+        self.searching = True
+        self.searchLine = self.textCursor().block().text()[len(self.prompt):]
+        self.searchQuery = ""
+        self.searchMatch = None
+        self.searchFailed = False
+        self.searchShow()
+
+    def searchKeyPress(self, event: QKeyEvent):
+        key = event.key()
+        control = event.modifiers() == Qt.KeyboardModifier.ControlModifier
+        if key == Qt.Key.Key_R and control:
+            # the next older match
+            if self.searchMatch is not None:
+                self.searchFind(self.searchMatch[0])
+        elif key in (Qt.Key.Key_G, Qt.Key.Key_C) and control or key == Qt.Key.Key_Escape:
+            self.searchEnd(self.searchLine)
+            return
+        elif key == Qt.Key.Key_Return:
+            cmd = self.searchMatch[1] if self.searchMatch is not None else self.searchLine
+            self.searchEnd(cmd)
+            self.onEnter(cmd)
+            return
+        elif key == Qt.Key.Key_Backspace:
+            self.searchQuery = self.searchQuery[:-1]
+            self.searchMatch = None
+            if self.searchQuery:
+                self.searchFind()
+        elif event.text() and event.text().isprintable() and not control:
+            self.searchQuery += event.text()
+            self.searchFind()
+        else:
+            # any other key leaves the search with the match on the line
+            self.searchEnd(self.searchMatch[1] if self.searchMatch is not None else self.searchLine)
+            return
+        self.searchShow()
+
+    def searchFind(self, before: int | None = None):
+        found = self.history.search(self.searchQuery, before)
+        # like readline, a failed search keeps showing the last match
+        self.searchFailed = found is None
+        if found is not None:
+            self.searchMatch = found
+
+    def searchShow(self):
+        match = self.searchMatch[1] if self.searchMatch is not None else ""
+        self.replaceLine(f"({'failing ' if self.searchFailed else ''}reverse-i-search)`{self.searchQuery}': {match}")
+
+    def searchEnd(self, cmd: str):
+        self.searching = False
+        self.replaceLine(self.prompt + cmd)
+        self.historyPos = None
 
 
@@ -0,0 +1,94 @@
+import argparse
+import sys
+import time
+
+from console import Shell, read_config
+from stats import Profiler
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def run(shell: Shell, lines, output, latencies: list):
+    """Run every command line, write its output and append the latency of each line in seconds to latencies.
+
+    Blank lines and lines starting with # are skipped. A line counts as done once its output is written.
+    """
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        start = time.perf_counter()
+        try:
+            written = False
+            for chunk in shell.stream(shell.onecmd(line)):
+                if output is not None:
+                    output.write(chunk)
+                written = True
+            if written and output is not None:
+                output.write("\n")
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+
+def report(latencies: list, elapsed: float, file):
+    ordered = sorted(latencies)
+    rate = len(ordered) / elapsed if elapsed > 0 else 0.0
+    print(f"{len(ordered)} commands in {elapsed:.3f} s, {rate:.1f} commands/s", file=file)
+    print("latency ms: " + "  ".join(f"{name} {percentile(ordered, fraction) * 1000:.3f}"
+                                     for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99),
+                                                            ("max", 1.0))), file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run shell commands from a script without the interactive loop.")
+    parser.add_argument("script", nargs="?", default="-", help="file with one command line per line, - for stdin")
+    parser.add_argument("-q", "--quiet", action="store_true", help="discard command output")
+    parser.add_argument("--no-stats", action="store_true", help="do not report throughput and latency on stderr")
+    parser.add_argument("--profile", nargs="?", const="cpu", choices=["cpu", "memory"],
+                        help="profile the session with cProfile (cpu, the default) or tracemalloc (memory), "
+                             "reports are written to profile_directory")
+    args = parser.parse_args()
+
+    config = read_config()
+    profiler = None
+    if args.profile is not None:
+        profiler = Profiler(args.profile, config.get("profile_directory", "."))
+        profiler.start()
+
+    shell = Shell(config)
+    start = time.perf_counter()
+    shell.system.wait()
+    if not args.no_stats:
+        print(f"image loaded in {time.perf_counter() - start:.3f} s", file=sys.stderr)
+
+    script = sys.stdin if args.script == "-" else open(args.script, encoding="utf-8")
+    latencies = []
+    status = 0
+    start = time.perf_counter()
+    try:
+        run(shell, script, None if args.quiet else sys.stdout, latencies)
+        status = shell.status
+    except SystemExit as e:
+        # exit in the script, the latency of the exit line itself is already recorded
+        status = e.code
+    finally:
+        elapsed = time.perf_counter() - start
+        if script is not sys.stdin:
+            script.close()
+    sys.stdout.flush()
+    if not args.no_stats:
+        report(latencies, elapsed, sys.stderr)
+    shell.logger.close()
+    if profiler is not None:
+        for path in profiler.stop():
+            print(f"profile written to {path}", file=sys.stderr)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
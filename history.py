@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import os
+from typing import Dict, List, Tuple
+
+from search import intersect, trigrams
+
+# bytes read per step when scanning the history file backwards
+BLOCK_SIZE = 64 * 1024
+
+
+def length(command: str) -> int:
+    """Bytes a command takes in the history file, with its line break."""
+    return len(command.encode("utf-8", "surrogateescape")) + 1
+
+
+class History:
+    """Command history kept in an append-only file, with at most `size` distinct commands.
+
+    Nothing is read until the history is first used, and then only the end of the file: it is scanned backwards
+    until `size` distinct commands are found. Running a command again moves it to the end instead of storing a
+    duplicate. The file is rewritten without duplicates once it has grown to twice the size of what it holds, when it
+    is loaded and as commands are added.
+    Reverse search looks commands up through a trigram index, newest first, built on the first search.
+    """
+
+    def __init__(self, path: str | None, size: int = 10000):
+        self.path = path
+        self.size = size
+        self.loaded = False
+        self.file = None
+        # id -> command, oldest first, ids grow with every command added
+        self.commands: Dict[int, str] = {}
+        self.ids: Dict[str, int] = {}
+        self.next_id = 0
+        # bytes of the file and of the commands kept, the file is compacted once it is twice as big
+        self.file_size = 0
+        self.content = 0
+        # trigram -> ids, None until the first search
+        self.postings: Dict[str, set[int]] | None = None
+        self.list: List[str] | None = None
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        if self.path is None:
+            return
+        try:
+            newest, self.file_size = self.read_tail()
+        except FileNotFoundError:
+            return
+        for command in reversed(newest):
+            self.insert(command)
+        if self.file_size > 2 * self.content:
+            self.compact()
+
+    def read_tail(self) -> Tuple[List[str], int]:
+        """Newest distinct commands of the file, newest first, and the size of the file."""
+        newest: List[str] = []
+        seen = set()
+        with open(self.path, "rb") as file:
+            position = file.seek(0, os.SEEK_END)
+            end = position
+            rest = b""
+            while position > 0 and len(newest) < self.size:
+                step = min(BLOCK_SIZE, position)
+                position -= step
+                file.seek(position)
+                lines = (file.read(step) + rest).split(b"\n")
+                # the first line may continue in the block before
+                rest = lines.pop(0) if position > 0 else b""
+                for line in reversed(lines):
+                    command = line.decode("utf-8", "surrogateescape")
+                    if command and command not in seen:
+                        seen.add(command)
+                        newest.append(command)
+                        if len(newest) == self.size:
+                            break
+        return newest, end
+
+    def compact(self):
+        self.close()
+        partial = self.path + ".tmp"
+        with open(partial, "w", encoding="utf-8", errors="surrogateescape") as file:
+            for command in self.commands.values():
+                file.write(command + "\n")
+        os.replace(partial, self.path)
+        self.file_size = self.content
+
+    def insert(self, command: str):
+        old = self.ids.get(command)
+        if old is not None:
+            self.forget(old)
+        elif len(self.commands) >= self.size:
+            self.forget(next(iter(self.commands)))
+        command_id = self.next_id
+        self.next_id += 1
+        self.commands[command_id] = command
+        self.ids[command] = command_id
+        self.content += length(command)
+        if self.postings is not None:
+            self.index(command_id, command)
+        self.list = None
+
+    def index(self, command_id: int, command: str):
+        for trigram in trigrams(command):
+            self.postings.setdefault(trigram, set()).add(command_id)
+
+    def forget(self, command_id: int):
+        command = self.commands.pop(command_id)
+        self.ids.pop(command, None)
+        self.content -= length(command)
+        for trigram in trigrams(command) if self.postings is not None else ():
+            posting = self.postings.get(trigram)
+            if posting is not None:
+                posting.discard(command_id)
+                if not posting:
+                    del self.postings[trigram]
+        self.list = None
+
+    def add(self, command: str):
+        command = command.replace("\n", " ")
+        if not command.strip():
+            return
+        self.load()
+        self.insert(command)
+        if self.path is None:
+            return
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8", errors="surrogateescape")
+        self.file.write(command + "\n")
+        self.file.flush()
+        self.file_size += length(command)
+        if self.file_size > 2 * self.content:
+            self.compact()
+
+    def entries(self) -> List[str]:
+        """Distinct commands, oldest first."""
+        self.load()
+        if self.list is None:
+            self.list = list(self.commands.values())
+        return self.list
+
+    def search(self, query: str, before: int | None = None) -> Tuple[int, str] | None:
+        """(id, command) of the newest command older than id `before` that contains query."""
+        self.load()
+        if self.postings is None:
+            self.postings = {}
+            for command_id, command in self.commands.items():
+                self.index(command_id, command)
+        ids = intersect(self.postings, trigrams(query))
+        # queries shorter than a trigram check commands newest first
+        candidates = reversed(self.commands) if ids is None else sorted(ids, reverse=True)
+        for command_id in candidates:
+            if before is not None and command_id >= before:
+                continue
+            command = self.commands[command_id]
+            if query in command:
+                return command_id, command
+        return None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __len__(self) -> int:
+        self.load()
+        return len(self.commands)
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import snapshot
+from structs import FileSystem, Directory
+
+# An image is one archive or a list of layers: the first is the base, each later one is mounted over the ones
+# before it. Files of an upper layer replace those below, directories merge, and OCI whiteouts hide what is
+# below: ".wh.<name>" removes <name>, ".wh..wh..opq" hides everything below in its directory.
+#
+# Compressed layers are decompressed once into a plain copy next to them, "<archive>.plain", so that lazy reads
+# and the process pool can memory map them like any plain archive. The copy is reused while a ".key" file next to
+# it matches the size, mtime and sampled hash of the compressed archive.
+
+WHITEOUT = ".wh."
+OPAQUE = ".wh..wh..opq"
+COMPRESSIONS = {".gz": "gzip", ".tgz": "gzip", ".zst": "zstd", ".tzst": "zstd"}
+CHUNK_SIZE = 2 ** 20
+
+
+def compression(path: str) -> str | None:
+    return COMPRESSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def plain_path(path: str) -> str:
+    return path + ".plain"
+
+
+def key_text(path: str) -> str:
+    size, mtime, digest = snapshot.archive_key(path)
+    return f"{size} {mtime} {digest.hex()}\n"
+
+
+def decompress(path: str) -> str:
+    """Path of a plain archive with the content of path, decompressed on first use."""
+    kind = compression(path)
+    if kind is None:
+        return path
+    key = key_text(path)
+    for plain in cached_paths(path):
+        try:
+            with open(plain + ".key", encoding="ascii") as file:
+                if file.read() == key and os.path.exists(plain):
+                    return plain
+        except OSError:
+            pass
+    error = None
+    for plain in cached_paths(path):
+        try:
+            write_plain(path, plain, kind)
+            with open(plain + ".key", "w", encoding="ascii") as file:
+                file.write(key)
+            return plain
+        except OSError as e:
+            # read-only or full image directory, the copy goes to the temporary directory instead
+            error = e
+    raise error
+
+
+def cached_paths(path: str) -> List[str]:
+    """Where the plain copy of a compressed archive may live: next to it, else in the temporary directory."""
+    digest = hashlib.blake2b(os.path.abspath(path).encode(), digest_size=8).hexdigest()
+    fallback = os.path.join(tempfile.gettempdir(), f"image-{digest}-{os.path.basename(path)}")
+    return [plain_path(path), plain_path(fallback)]
+
+
+def write_plain(path: str, plain: str, kind: str):
+    partial = plain + ".part"
+    try:
+        with open(path, "rb") as source, open(partial, "wb") as target:
+            if kind == "gzip":
+                import gzip
+
+                with gzip.GzipFile(fileobj=source) as stream:
+                    shutil.copyfileobj(stream, target, CHUNK_SIZE)
+            else:
+                try:
+                    import zstandard
+                except ImportError:
+                    raise RuntimeError(f"{path}: reading .zst images needs the zstandard package") from None
+                zstandard.ZstdDecompressor().copy_stream(source, target, read_size=CHUNK_SIZE,
+                                                         write_size=CHUNK_SIZE)
+        os.replace(partial, plain)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def restore(system: FileSystem, paths: str | List[str], lazy: bool = True, workers: int | None = None):
+    """Fill system with an image made of one archive or a list of layers, compressed or not.
+
+    Compressed layers are decompressed in parallel threads first, zlib and zstd release the GIL. Every layer
+    is then loaded from its index, or parsed and indexed, and mounted over the ones before it.
+    """
+    paths = [paths] if isinstance(paths, str) else list(paths)
+    # upper layers may still replace or hide what the base has, only a single archive is final as it loads
+    system.early = len(paths) == 1
+    compressed = [path for path in paths if compression(path) is not None]
+    plain = {}
+    if compressed:
+        with ThreadPoolExecutor(workers or min(len(compressed), os.cpu_count() or 1)) as executor:
+            plain = dict(zip(compressed, executor.map(decompress, compressed)))
+    paths = [plain.get(path, path) for path in paths]
+
+    snapshot.restore(system, paths[0], lazy)
+    if len(paths) > 1:
+        # the base layer has nothing below it to hide
+        strip_whiteouts(system)
+    for path in paths[1:]:
+        layer = FileSystem()
+        snapshot.restore(layer, path, lazy)
+        mount(system, layer)
+    if len(paths) > 1:
+        system.aggregate_sizes()
+        system.changed()
+
+
+def mount(lower: Directory, upper: Directory):
+    """Merge the tree of upper into lower, upper nodes are moved, not copied."""
+    stack = [(lower, upper)]
+    while stack:
+        target, source = stack.pop()
+        if OPAQUE in source.index:
+            target.index.clear()
+        for name, node in source.index.items():
+            if name.startswith(WHITEOUT):
+                if name != OPAQUE:
+                    target.index.pop(name[len(WHITEOUT):], None)
+                continue
+            existing = target.index.get(name)
+            if node.isdir() and existing is not None and existing.isdir():
+                existing.mtime = node.timestamp
+                stack.append((existing, node))
+                continue
+            node.parent = target
+            target.index[name] = node
+            if node.isdir():
+                node.forget_paths()
+                strip_whiteouts(node)
+        # whiteouts only apply to the layers below, none is left in the merged directory
+        for name in [name for name in target.index if name.startswith(WHITEOUT)]:
+            del target.index[name]
+
+
+def strip_whiteouts(directory: Directory):
+    """Drop whiteouts from a subtree that has nothing below it to hide."""
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        for name in [name for name in current.index if name.startswith(WHITEOUT)]:
+            del current.index[name]
+        stack.extend(child for child in current.children if child.isdir())
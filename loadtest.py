@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import time
+
+from headless import report
+from server import END
+
+COMMANDS = ["pwd", "ls", "ls -l", "cd /", "echo hello", "cal", "find / -type d"]
+
+
+async def connect(address: str):
+    """host:port, or the path of a Unix socket."""
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return await asyncio.open_connection(host, int(port))
+    return await asyncio.open_unix_connection(address)
+
+
+async def receive(reader: asyncio.StreamReader) -> int:
+    """Read one answer up to its end marker, returns its size in bytes."""
+    size = 0
+    while True:
+        data = await reader.read(1 << 16)
+        if not data:
+            raise ConnectionError("server closed the connection")
+        size += len(data)
+        if data.endswith(END):
+            return size
+
+
+async def session(address: str, commands: list, repeat: int, latencies: list):
+    reader, writer = await connect(address)
+    try:
+        await receive(reader)
+        for _ in range(repeat):
+            for command in commands:
+                start = time.perf_counter()
+                writer.write(command.encode() + b"\n")
+                await receive(reader)
+                latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def run(address: str, sessions: int, commands: list, repeat: int) -> tuple[list, float]:
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(session(address, commands, repeat, latencies) for _ in range(sessions)))
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a shell server with concurrent sessions.")
+    parser.add_argument("address", nargs="?", default="127.0.0.1:2323", help="host:port or Unix socket path")
+    parser.add_argument("-n", "--sessions", type=int, default=10, help="concurrent sessions")
+    parser.add_argument("-r", "--repeat", type=int, default=100, help="times each session runs the commands")
+    parser.add_argument("--script", help="file with one command line per line, a built-in mix by default")
+    args = parser.parse_args()
+
+    commands = COMMANDS
+    if args.script is not None:
+        with open(args.script, encoding="utf-8") as file:
+            commands = [line.rstrip("\r\n") for line in file if line.strip() and not line.lstrip().startswith("#")]
+
+    latencies, elapsed = asyncio.run(run(args.address, args.sessions, commands, args.repeat))
+    print(f"{args.sessions} sessions")
+    report(latencies, elapsed, None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,33 @@
+import argparse
 import sys
-from PySide6.QtWidgets import QApplication
-from emulator import Console
+from console import read_config, load_system
+from stats import Profiler
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    console = Console()
+    parser = argparse.ArgumentParser(description="Shell emulator console.")
+    parser.add_argument("--profile", nargs="?", const="cpu", choices=["cpu", "memory"],
+                        help="profile the session with cProfile (cpu, the default) or tracemalloc (memory), "
+                             "reports are written to profile_directory")
+    # the rest is left to Qt
+    args, rest = parser.parse_known_args()
+
+    config = read_config()
+    profiler = None
+    if args.profile is not None:
+        profiler = Profiler(args.profile, config.get("profile_directory", "."))
+        profiler.start()
+
+    # the image loads in the background while Qt starts and the window is built
+    system = load_system(config)
+
+    from PySide6.QtWidgets import QApplication
+    from emulator import Console
+
+    app = QApplication(sys.argv[:1] + rest)
+    console = Console(profiler=profiler, config=config, system=system)
     console.show()
-    sys.exit(app.exec())
+    status = app.exec()
+    if profiler is not None:
+        for path in profiler.stop():
+            print(f"profile written to {path}", file=sys.stderr)
+    sys.exit(status)
@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import io
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List
+
+from structs import FileSystem, Directory, File, LRUCache
+
+if TYPE_CHECKING:
+    import tarfile
+
+# bytes per read when streaming file content into an exported archive
+CHUNK_SIZE = 2 ** 20
+# marks a cached lookup that found nothing
+MISSING = object()
+
+
+class Overlay:
+    """Copy-on-write changes of one session on top of a shared, read-only tree.
+
+    Nodes of the base tree are never modified. A changed base directory gets an entry in `changes` that maps child
+    names to the node that replaces them, or to None for a whiteout. Nodes created by the overlay are owned by it:
+    they hang below base directories through their parent pointer only, and the index of an overlay directory is
+    authoritative. Touching or moving a base file copies its metadata into the overlay, file content is shared.
+    A moved base directory is replaced by an alias: an overlay directory that shares the index of the base one and
+    that the base children see as their parent, nothing below it is copied. Size and mtime changes of base
+    directories are kept aside, so memory grows with the changes only.
+    """
+
+    def __init__(self, system: FileSystem, cache_size: int = 1024, listing_cache_size: int = 64):
+        self.system = system
+        self.changes: Dict[Directory, Dict[str, Directory | File | None]] = {}
+        # size differences and new mtimes of base directories
+        self.deltas: Dict[Directory, int] = {}
+        self.mtimes: Dict[Directory, int] = {}
+        # nodes created by the overlay
+        self.owned: set[Directory | File] = set()
+        # moved base directory -> its alias, and the other way round
+        self.aliases: Dict[Directory, Directory] = {}
+        self.redirects: Dict[Directory, Directory] = {}
+        # bumped on every change
+        self.generation = 0
+        # (directory, path) -> node, valid for the generations of the base tree and the overlay it was filled at
+        self.paths = LRUCache(cache_size)
+        # directory -> sorted child names, for completion
+        self.listings = LRUCache(listing_cache_size)
+        self.cache_generation = (system.generation, self.generation)
+
+    @property
+    def clean(self) -> bool:
+        return not self.changes and not self.mtimes
+
+    def child(self, directory: Directory, name: str) -> Directory | File | None:
+        entries = self.changes.get(directory)
+        if entries is not None and name in entries:
+            return entries[name]
+        return directory.get_child(name)
+
+    def children(self, directory: Directory) -> List[Directory | File] | Iterator[Directory | File]:
+        entries = self.changes.get(directory)
+        if entries is None:
+            return directory.children
+        result = [child for child in directory.children if child.name not in entries]
+        result.extend(node for node in entries.values() if node is not None)
+        return result
+
+    def parent(self, node: Directory | File) -> Directory | None:
+        parent = node.parent
+        return self.aliases.get(parent, parent)
+
+    def path(self, node: Directory | File) -> str:
+        """Absolute path of a node in the merged tree."""
+        names = []
+        # base paths are cached in the tree, they only hold above the overlay nodes and while nothing is aliased
+        while node in self.owned or self.aliases and node.parent is not None:
+            names.append(node.name)
+            node = self.parent(node)
+        path = node.abspath
+        if not names:
+            return path
+        return path.rstrip("/") + "/" + "/".join(reversed(names))
+
+    def within(self, node: Directory | File, directory: Directory) -> bool:
+        while node is not None:
+            if node is directory:
+                return True
+            node = self.parent(node)
+        return False
+
+    def size(self, node: Directory | File) -> int:
+        return node.size + self.deltas.get(node, 0)
+
+    def timestamp(self, node: Directory | File) -> int:
+        mtime = self.mtimes.get(node)
+        return node.timestamp if mtime is None else mtime
+
+    def sizes(self, nodes: Iterable[Directory | File]) -> List[int]:
+        """Merged sizes of many nodes at once."""
+        deltas = self.deltas
+        if not deltas:
+            return [node.size for node in nodes]
+        return [node.size + deltas.get(node, 0) for node in nodes]
+
+    def timestamps(self, nodes: Iterable[Directory | File]) -> List[int]:
+        """Merged mtimes of many nodes at once."""
+        mtimes = self.mtimes
+        if not mtimes:
+            return [node.timestamp for node in nodes]
+        return [mtimes.get(node, node.timestamp) for node in nodes]
+
+    def mtime(self, node: Directory | File) -> datetime | None:
+        mtime = self.mtimes.get(node)
+        return node.mtime if mtime is None else datetime.fromtimestamp(mtime)
+
+    def validate(self):
+        """Drop cached lookups and listings once the base tree or the overlay has changed."""
+        generation = (self.system.generation, self.generation)
+        if generation != self.cache_generation:
+            self.paths.clear()
+            self.listings.clear()
+            self.cache_generation = generation
+
+    def resolve(self, directory: Directory, path: str) -> Directory | File | None:
+        self.validate()
+        key = (directory, path)
+        node = self.paths.get(key, MISSING)
+        if node is MISSING:
+            node = directory.search_by_coord(path, self.child, self.parent)
+            self.paths.put(key, node)
+        return node
+
+    def listing(self, directory: Directory) -> List[str]:
+        """Sorted names of the merged children of directory.
+
+        Built on first use and cached until the tree changes, prefixes are then found by binary search.
+        """
+        self.validate()
+        listing = self.listings.get(directory)
+        if listing is None:
+            entries = self.changes.get(directory)
+            if entries is None:
+                listing = sorted(directory.index)
+            else:
+                listing = sorted(child.name for child in self.children(directory))
+            self.listings.put(directory, listing)
+        return listing
+
+    def walk(self, directory: Directory) -> Iterator[Directory | File]:
+        """Pre-order walk of the merged subtree below directory."""
+        stack = list(reversed(list(self.children(directory))))
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.isdir():
+                stack.extend(reversed(list(self.children(node))))
+
+    def set(self, directory: Directory, name: str, node: Directory | File | None):
+        """Make node the child called name of directory, None removes the child."""
+        old = self.child(directory, name)
+        if directory in self.owned:
+            if node is None:
+                directory.index.pop(name, None)
+            else:
+                directory.index[name] = node
+        else:
+            entries = self.changes.setdefault(directory, {})
+            if node is None and directory.get_child(name) is None:
+                # nothing to hide in the base
+                entries.pop(name, None)
+                if not entries:
+                    del self.changes[directory]
+            else:
+                entries[name] = node
+        if node is not None:
+            # overlay paths are derived through parent(), cached paths of the nodes are never used
+            node.parent = directory
+            node.name = name
+        delta = (self.size(node) if node is not None else 0) - (self.size(old) if old is not None else 0)
+        self.resize(directory, delta)
+        self.stamp(directory)
+
+    def resize(self, directory: Directory, delta: int):
+        """Add delta to the merged size of directory and its ancestors."""
+        if not delta:
+            return
+        node = directory
+        while node is not None:
+            if node in self.owned:
+                node.size += delta
+            else:
+                self.deltas[node] = self.deltas.get(node, 0) + delta
+            node = self.parent(node)
+
+    def stamp(self, node: Directory | File, mtime: int | None = None):
+        """Set the mtime of an overlay node or a base directory, now by default."""
+        mtime = int(time.time()) if mtime is None else mtime
+        if node in self.owned:
+            node.mtime = mtime
+        else:
+            self.mtimes[node] = mtime
+        self.generation += 1
+
+    def mkdir(self, directory: Directory, name: str) -> Directory:
+        node = Directory(None, name, int(time.time()))
+        self.owned.add(node)
+        self.set(directory, name, node)
+        return node
+
+    def write(self, directory: Directory, name: str, content: bytes, append: bool = False) -> File:
+        """Create or replace a file, or add content to the end of it."""
+        old = self.child(directory, name)
+        if append and old is not None and old.isfile():
+            content = old.content + content
+        node = File(None, name, content, len(content), int(time.time()))
+        self.owned.add(node)
+        self.set(directory, name, node)
+        return node
+
+    def touch(self, directory: Directory, name: str):
+        """Create an empty file or update the mtime of an existing node."""
+        node = self.child(directory, name)
+        if node is None:
+            self.write(directory, name, b"")
+        elif node in self.owned or node.isdir():
+            self.stamp(node)
+        else:
+            # base file: the copy shares its content
+            node = self.copy(node)
+            self.stamp(node)
+            self.set(directory, name, node)
+
+    def remove(self, directory: Directory, name: str):
+        self.set(directory, name, None)
+
+    def move(self, node: Directory | File, directory: Directory, name: str):
+        """Move node to directory under a new name, replacing what was there."""
+        source = self.parent(node)
+        if node in self.owned or node in self.redirects:
+            moved = node
+        elif node.isdir():
+            moved = self.alias(node)
+        else:
+            moved = self.copy(node)
+        self.set(source, node.name, None)
+        self.set(directory, name, moved)
+
+    def copy(self, file: File) -> File:
+        """Overlay copy of a base file, its content is shared with the original."""
+        copied = File(None, file.name, file._content, file.size, file.timestamp, file.archive, file.offset)
+        self.owned.add(copied)
+        return copied
+
+    def alias(self, directory: Directory) -> Directory:
+        """Overlay directory standing in for a base directory, with its children and the changes made to them."""
+        alias = Directory(None, directory.name, self.timestamp(directory))
+        alias.size = self.size(directory)
+        # shared, never modified: changes below the alias are kept in `changes` like those of a base directory
+        alias.index = directory.index
+        entries = self.changes.pop(directory, None)
+        if entries is not None:
+            self.changes[alias] = entries
+        self.aliases[directory] = alias
+        self.redirects[alias] = directory
+        return alias
+
+    def current(self, directory: Directory) -> Directory:
+        """The node that stands for directory in the merged tree, its alias once it has been moved."""
+        return self.aliases.get(directory, directory)
+
+    def export(self, tar: tarfile.TarFile, directory: Directory, root: str = "system") -> Iterator[str]:
+        """Stream the merged subtree below directory into tar, under a top directory called root.
+
+        The tree is walked once and file content is copied in chunks, yields the name of every member written.
+        """
+        import tarfile
+
+        info = tarfile.TarInfo(root)
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        info.mtime = self.timestamp(directory)
+        tar.addfile(info)
+        yield root
+        start = len(self.path(directory).rstrip("/"))
+        for node in self.walk(directory):
+            info = tarfile.TarInfo(root + self.path(node)[start:])
+            info.mtime = self.timestamp(node)
+            if node.isdir():
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(info)
+            else:
+                info.size = node.size
+                info.mode = 0o644
+                tar.addfile(info, FileReader(node))
+            yield info.name
+
+
+class FileReader(io.RawIOBase):
+    """Read-only file object over the content of a File, read chunk by chunk."""
+
+    def __init__(self, file: File):
+        super().__init__()
+        self.chunks = file.chunks(CHUNK_SIZE)
+        self.pending = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self.pending:
+            self.pending = next(self.chunks, memoryview(b""))
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import atexit
+import hashlib
+import heapq
+import multiprocessing
+import os
+import re
+import tarfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator, List, Tuple
+
+import search
+from structs import Archive, File
+
+# batches smaller than this are processed in-process, a pool round trip would cost more
+PARALLEL_THRESHOLD = 16 * 2 ** 20
+CHUNK_SIZE = 2 ** 20
+
+_pools: dict[int, ProcessPoolExecutor] = {}
+_lock = threading.Lock()
+# archives opened by a worker process, by path
+_archives: dict[str, Archive] = {}
+
+
+def pool(workers: int) -> ProcessPoolExecutor:
+    """Process pool of the given size, started once and reused."""
+    with _lock:
+        executor = _pools.get(workers)
+        if executor is None:
+            # spawn: the shell process runs Qt and logger threads that must not be forked
+            executor = _pools[workers] = ProcessPoolExecutor(workers, multiprocessing.get_context("spawn"))
+    return executor
+
+
+@atexit.register
+def shutdown():
+    with _lock:
+        for executor in _pools.values():
+            executor.shutdown(cancel_futures=True)
+        _pools.clear()
+
+
+def shard(sizes: List[int], count: int) -> List[List[int]]:
+    """Split item indexes into at most `count` shards of similar total size, placing the largest items first."""
+    shards: List[List[int]] = [[] for _ in range(count)]
+    heap = [(0, i) for i in range(count)]
+    for index in sorted(range(len(sizes)), key=sizes.__getitem__, reverse=True):
+        total, i = heapq.heappop(heap)
+        shards[i].append(index)
+        heapq.heappush(heap, (total + sizes[index], i))
+    return [items for items in shards if items]
+
+
+def process(task: str, data, argument):
+    if task == "md5":
+        digest = hashlib.md5()
+        view = memoryview(data)
+        for start in range(0, len(view), CHUNK_SIZE):
+            digest.update(view[start:start + CHUNK_SIZE])
+        return digest.hexdigest()
+    if task == "grep":
+        return list(search.search_text(data, argument))
+    raise ValueError(f"unknown task {task}")
+
+
+def process_file(task: str, file: File, argument):
+    if task == "md5":
+        digest = hashlib.md5()
+        for chunk in file.chunks(CHUNK_SIZE):
+            digest.update(chunk)
+        return digest.hexdigest()
+    return process(task, file.content, argument)
+
+
+def run_shard(task: str, argument, items: List[Tuple[int, str, int, int]]) -> List[Tuple[int, object]]:
+    """Worker side: read every item straight from its archive and process it."""
+    results = []
+    for index, path, offset, size in items:
+        archive = _archives.get(path)
+        if archive is None:
+            archive = _archives[path] = Archive(tarfile.open(path))
+        data = archive.view(offset, size)
+        if data is None:
+            data = archive.read(offset, size)
+        results.append((index, process(task, data, argument)))
+    return results
+
+
+def run(task: str, argument, files: List[File], workers: int | None = None) -> Iterator[object]:
+    """Result of the task for every file, in order.
+
+    Files are sharded by size across a process pool. Workers get archive paths and offsets instead of file
+    contents, in-memory files and small batches are processed here.
+    """
+    workers = workers or os.cpu_count() or 1
+    locations = [file.location() for file in files]
+    remote = [i for i, location in enumerate(locations) if location is not None]
+    if workers == 1 or sum(files[i].size for i in remote) < PARALLEL_THRESHOLD:
+        for file in files:
+            yield process_file(task, file, argument)
+        return
+
+    results: dict[int, object] = {}
+    executor = pool(workers)
+    futures = set()
+    for items in shard([files[i].size for i in remote], workers):
+        futures.add(executor.submit(run_shard, task, argument,
+                                    [(remote[i], *locations[remote[i]]) for i in items]))
+    try:
+        for i, location in enumerate(locations):
+            if location is None:
+                results[i] = process_file(task, files[i], argument)
+        for i in range(len(files)):
+            while i not in results:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results.update(future.result())
+            yield results.pop(i)
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def md5(files: List[File], workers: int | None = None) -> Iterator[str]:
+    return run("md5", None, files, workers)
+
+
+def grep(files: List[File], regex: re.Pattern, workers: int | None = None) -> Iterator[List[Tuple[int, str]]]:
+    return run("grep", regex, files, workers)
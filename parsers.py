@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterator
+
+from structs import ArgumentParser, _HelpAction
+
+# the value of cal -y without a year
+CURRENT_YEAR = object()
+
+# command -> function building its parser
+_builders: Dict[str, Callable[[], ArgumentParser]] = {}
+
+
+def builder(command: str):
+    """Register the decorated function as the one building the parser of command."""
+    def register(build: Callable[[], ArgumentParser]) -> Callable[[], ArgumentParser]:
+        _builders[command] = build
+        return build
+    return register
+
+
+class Parsers(Mapping):
+    """Parsers of the shell commands by name, each built on first use.
+
+    Every session keeps its own: argparse changes parser state while parsing intermixed arguments, so a parser
+    must not be shared between threads.
+    """
+
+    def __init__(self):
+        self.built: Dict[str, ArgumentParser] = {}
+
+    def __getitem__(self, command: str) -> ArgumentParser:
+        parser = self.built.get(command)
+        if parser is None:
+            parser = self.built[command] = _builders[command]()
+        return parser
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(_builders)
+
+    def __len__(self) -> int:
+        return len(_builders)
+
+    def __contains__(self, command) -> bool:
+        return command in _builders
+
+
+@builder("pwd")
+def pwd_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="pwd",
+        description="Print the name of the current working directory.",
+        add_help=False,
+        exit_on_error=False
+    )
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    return parser
+
+
+@builder("cat")
+def cat_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="cat",
+        description="Concatenate FILE(s) to standard output.",
+        add_help=False
+    )
+    parser.add_argument("-l", action="store_true", help="use a long listing format")
+    parser.add_argument("-v", "--show-nonprinting", action="store_true",
+                        help="use ^ and M- notation, except for LFD and TAB")
+    limit = parser.add_mutually_exclusive_group()
+    limit.add_argument("--head", type=int, metavar="N", help="output only the first N bytes of each FILE")
+    limit.add_argument("--tail", type=int, metavar="N", help="output only the last N bytes of each FILE")
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("files", type=str, nargs="*", metavar="FILE")
+    return parser
+
+
+@builder("ls")
+def ls_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="ls",
+        description="List information about the FILEs (the current directory by default).",
+        add_help=False
+    )
+    parser.add_argument("-a", "--all", action="store_true", help="do not ignore entries starting with .")
+    parser.add_argument("-l", action="store_true", help="use a long listing format")
+    parser.add_argument("-1", dest="one", action="store_true", help="list one file per line")
+    parser.add_argument("-R", "--recursive", action="store_true", help="list subdirectories recursively")
+    parser.add_argument("-r", "--reverse", action="store_true", help="reverse order while sorting")
+    parser.add_argument("-S", dest="sort", action="store_const", const="size", default="name",
+                        help="sort by file size, largest first")
+    parser.add_argument("-t", dest="sort", action="store_const", const="time",
+                        help="sort by modification time, newest first")
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("files", type=str, nargs="*", metavar="FILE")
+    return parser
+
+
+@builder("cd")
+def cd_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="cd",
+        description="Change the shell working directory.",
+        add_help=False
+    )
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("dir", type=str, nargs="*")
+    return parser
+
+
+@builder("exit")
+def exit_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="exit",
+        description="Exit the shell with a status of N.",
+        add_help=False
+    )
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("status", type=str, nargs="*", metavar="N", default=["0"])
+    return parser
+
+
+@builder("echo")
+def echo_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="echo",
+        description="Echo the STRING(s) to standard output.",
+        add_help=False
+    )
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("strings", type=str, nargs="*", metavar="arg", default=[""])
+    return parser
+
+
+@builder("stats")
+def stats_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="stats",
+        description="Show how long the phases of running each command took, recorded while stats are on.",
+        add_help=False
+    )
+    parser.add_argument("--json", action="store_true", help="print the histograms as JSON")
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("action", nargs="?", choices=["show", "on", "off", "reset"], default="show",
+                        help="show the timings, start or stop recording, or drop what was recorded")
+    return parser
+
+
+@builder("cal")
+def cal_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="cal",
+        description="Displays a calendar.",
+        add_help=False
+    )
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("-d", type=str, nargs="?", metavar="yyyy-mm", help="display the given month")
+    parser.add_argument("-y", type=int, nargs="?", metavar="yyyy", const=CURRENT_YEAR,
+                        help="display the given year, the current one by default")
+    parser.add_argument("-3", dest="three", action="store_true",
+                        help="display the previous, current and next month")
+    parser.add_argument("range", type=str, nargs="?", metavar="yyyy-mm..yyyy-mm",
+                        help="display every month from the first to the last")
+    return parser
+
+
+@builder("find")
+def find_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="find",
+        description="Search for files in a directory hierarchy.",
+        add_help=False,
+        intermixed=True,
+        signed=("-size", "-mtime")
+    )
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("paths", type=str, nargs="*", metavar="PATH", default=["."])
+    parser.add_argument("-name", type=str, metavar="PATTERN", help="base of file name matches PATTERN")
+    parser.add_argument("-iname", type=str, metavar="PATTERN",
+                        help="like -name, but the match is case insensitive")
+    parser.add_argument("-type", type=str, choices=["f", "d"],
+                        help="file is a regular file (f) or a directory (d)")
+    parser.add_argument("-size", type=str, metavar="[+-]N[cwbkMG]",
+                        help="file uses N units of space, rounding up")
+    parser.add_argument("-mtime", type=str, metavar="[+-]N",
+                        help="file's data was last modified N*24 hours ago")
+    return parser
+
+
+@builder("grep")
+def grep_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="grep",
+        description="Search for PATTERN in each FILE.",
+        add_help=False,
+        intermixed=True
+    )
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("-i", action="store_true", help="ignore case distinctions")
+    parser.add_argument("-r", action="store_true", help="read all files under each directory")
+    parser.add_argument("-l", action="store_true", help="print only names of FILEs with matches")
+    parser.add_argument("-n", action="store_true", help="print line number with output lines")
+    parser.add_argument("pattern", type=str, metavar="PATTERN")
+    parser.add_argument("files", type=str, nargs="*", metavar="FILE", default=[])
+    return parser
+
+
+@builder("md5sum")
+def md5sum_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="md5sum",
+        description="Print MD5 (128-bit) checksums.",
+        add_help=False
+    )
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("-r", action="store_true", help="read all files under each directory")
+    parser.add_argument("files", type=str, nargs="*", metavar="FILE")
+    return parser
+
+
+@builder("mkdir")
+def mkdir_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="mkdir",
+        description="Create the DIRECTORY(ies), if they do not already exist.",
+        add_help=False
+    )
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("-p", action="store_true",
+                        help="no error if existing, make parent directories as needed")
+    parser.add_argument("dirs", type=str, nargs="*", metavar="DIRECTORY")
+    return parser
+
+
+@builder("touch")
+def touch_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="touch",
+        description="Update the modification time of each FILE to the current time.",
+        add_help=False
+    )
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("files", type=str, nargs="*", metavar="FILE")
+    return parser
+
+
+@builder("rm")
+def rm_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="rm",
+        description="Remove (unlink) the FILE(s).",
+        add_help=False
+    )
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("-r", "-R", action="store_true",
+                        help="remove directories and their contents recursively")
+    parser.add_argument("-f", action="store_true", help="ignore nonexistent files, never prompt")
+    parser.add_argument("files", type=str, nargs="*", metavar="FILE")
+    return parser
+
+
+@builder("mv")
+def mv_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="mv",
+        description="Rename SOURCE to DEST, or move SOURCE(s) to DIRECTORY.",
+        add_help=False
+    )
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("files", type=str, nargs="*", metavar="SOURCE")
+    return parser
+
+
+@builder("tar")
+def tar_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        prog="tar",
+        description="Write the tree below DIR (the root by default), with this session's changes, to a new "
+                    "archive in the export directory.",
+        add_help=False
+    )
+    parser.add_argument("--help", action=_HelpAction, help="show this help message and exit")
+    parser.add_argument("-c", action="store_true", help="create a new archive")
+    parser.add_argument("-v", action="store_true", help="verbosely list files processed")
+    parser.add_argument("-f", type=str, metavar="ARCHIVE", help="use archive file ARCHIVE")
+    parser.add_argument("dir", type=str, nargs="?", metavar="DIR", default="/")
+    return parser
@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import fnmatch
+import re
+import threading
+import time
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+from structs import FileSystem, Directory, File
+from overlay import Overlay
+
+# files above this size are left out of the content index and always searched
+MAX_INDEXED_SIZE = 4 * 2 ** 20
+
+_lock = threading.Lock()
+# (system, key) of indexes being built in the background
+_building: set = set()
+
+
+def trigrams(text: str | bytes) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def token_trigrams(data: bytes) -> set:
+    """Trigrams that lie within whitespace-separated tokens.
+
+    Each distinct token is only processed once, and a literal's own token trigrams always appear in any text
+    that contains it.
+    """
+    result = set()
+    for token in set(data.split()):
+        result.update(token[i:i + 3] for i in range(len(token) - 2))
+    return result
+
+
+def intersect(postings: dict, keys: Iterable) -> set | None:
+    """Ids present in the posting set of every key, None when there are no keys to filter by."""
+    sets = []
+    for key in set(keys):
+        posting = postings.get(key)
+        if posting is None:
+            return set()
+        sets.append(posting)
+    if not sets:
+        return None
+    sets.sort(key=len)
+    result = set(sets[0])
+    for posting in sets[1:]:
+        result &= posting
+        if not result:
+            break
+    return result
+
+
+def walk(directory: Directory) -> Iterator[Directory | File]:
+    """Pre-order walk of the subtree below directory, children in listing order."""
+    stack = list(reversed(directory.children))
+    while stack:
+        node = stack.pop()
+        yield node
+        if node.isdir():
+            stack.extend(reversed(node.children))
+
+
+def within(node: Directory | File, directory: Directory) -> bool:
+    while node is not None:
+        if node is directory:
+            return True
+        node = node.parent
+    return False
+
+
+class NameIndex:
+    """Trigram index over the lower-cased names of every node."""
+
+    def __init__(self, system: FileSystem):
+        self.nodes: List[Directory | File] = []
+        self.postings: dict[str, set[int]] = {}
+        for node in walk(system):
+            node_id = len(self.nodes)
+            self.nodes.append(node)
+            for trigram in trigrams(node.name.lower()):
+                self.postings.setdefault(trigram, set()).add(node_id)
+
+    def candidates(self, literals: Iterable[str]) -> List[Directory | File]:
+        """Nodes in tree order whose name may contain every literal."""
+        ids = intersect(self.postings, (trigram for literal in literals for trigram in trigrams(literal.lower())))
+        return self.nodes if ids is None else [self.nodes[i] for i in sorted(ids)]
+
+
+class ContentIndex:
+    """Trigram index over the ASCII-lower-cased words of every file up to MAX_INDEXED_SIZE."""
+
+    def __init__(self, system: FileSystem):
+        self.files: List[File] = []
+        self.ids: dict[File, int] = {}
+        self.unindexed: set[int] = set()
+        self.postings: dict[bytes, set[int]] = {}
+        for node in walk(system):
+            if not node.isfile():
+                continue
+            file_id = len(self.files)
+            self.files.append(node)
+            self.ids[node] = file_id
+            if node.size > MAX_INDEXED_SIZE:
+                self.unindexed.add(file_id)
+                continue
+            for trigram in token_trigrams(node.content.lower()):
+                self.postings.setdefault(trigram, set()).add(file_id)
+
+    def candidates(self, literals: Iterable[bytes]) -> set[File] | None:
+        """Files that may contain every literal, None if the literals are too short to filter by."""
+        ids = intersect(self.postings, (trigram for literal in literals for trigram in token_trigrams(literal.lower())))
+        if ids is None:
+            return None
+        return {self.files[i] for i in ids | self.unindexed}
+
+
+def cached(system: FileSystem, key: str, build: Callable, wait: bool = True):
+    """Index built once per generation of the tree and shared by every shell on it.
+
+    With wait=False a missing index is built in a background thread and None is returned until it is ready.
+    """
+    with _lock:
+        index = system.cache.get(key)
+        if index is not None:
+            return index
+        if wait:
+            index = system.cache[key] = build(system)
+            return index
+        if (system, key) in _building:
+            return None
+        _building.add((system, key))
+
+    def target():
+        generation = system.generation
+        index = build(system)
+        with _lock:
+            _building.discard((system, key))
+            if system.generation == generation:
+                system.cache[key] = index
+
+    threading.Thread(target=target, name=f"index-{key}", daemon=True).start()
+    return None
+
+
+def name_index(system: FileSystem) -> NameIndex:
+    return cached(system, "names", NameIndex)
+
+
+def content_index(system: FileSystem, wait: bool = True) -> ContentIndex | None:
+    return cached(system, "content", ContentIndex, wait)
+
+
+def glob_literals(pattern: str) -> List[str]:
+    """Literal runs of a glob pattern that every matching name contains."""
+    return [part for part in re.split(r"[*?]|\[[^]]*]", pattern) if len(part) >= 3]
+
+
+def regex_literals(pattern: str, ignore_case: bool = False) -> List[str]:
+    """Literal runs at the top level of a regex that every match contains.
+
+    The content index only folds ASCII case, so case-insensitive patterns keep their ASCII literals only.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return []
+    ignore_case = ignore_case or bool(parsed.state.flags & re.IGNORECASE)
+    literals = []
+    current = []
+    for op, value in parsed:
+        if op is sre_constants.LITERAL:
+            current.append(chr(value))
+        else:
+            literals.append("".join(current))
+            current = []
+    literals.append("".join(current))
+    return [literal for literal in literals if len(literal) >= 3 and (literal.isascii() or not ignore_case)]
+
+
+def size_test(spec: str) -> Callable[[int], bool]:
+    """find -size: [+-]N[cwbkMG], in 512-byte blocks by default, sizes are rounded up to the unit."""
+    match = re.fullmatch(r"([+-]?)(\d+)([cwbkMG]?)", spec)
+    if match is None:
+        raise ValueError(f"invalid -size argument '{spec}'")
+    sign, number, unit = match.groups()
+    unit = {"c": 1, "w": 2, "b": 512, "": 512, "k": 1024, "M": 1024 ** 2, "G": 1024 ** 3}[unit]
+    number = int(number)
+    if sign == "+":
+        return lambda size: -(-size // unit) > number
+    if sign == "-":
+        return lambda size: -(-size // unit) < number
+    return lambda size: -(-size // unit) == number
+
+
+def mtime_test(spec: str, now: float | None = None) -> Callable[[int], bool]:
+    """find -mtime: [+-]N, age in whole days."""
+    match = re.fullmatch(r"([+-]?)(\d+)", spec)
+    if match is None:
+        raise ValueError(f"invalid -mtime argument '{spec}'")
+    sign, number = match.groups()
+    number = int(number)
+    now = time.time() if now is None else now
+    if sign == "+":
+        return lambda timestamp: (now - timestamp) // 86400 > number
+    if sign == "-":
+        return lambda timestamp: (now - timestamp) // 86400 < number
+    return lambda timestamp: (now - timestamp) // 86400 == number
+
+
+def find(system: FileSystem, start: Directory | File, name: str | None = None, ignore_case: bool = False,
+         kind: str | None = None, size: str | None = None, mtime: str | None = None,
+         overlay: Overlay | None = None) -> Iterator[Directory | File]:
+    """Nodes below and including start that pass every given test, in tree order.
+
+    With an overlay that has changes the merged tree is walked, the name index only covers the base.
+    """
+    size_of = overlay.size if overlay is not None else lambda node: node.size
+    timestamp_of = overlay.timestamp if overlay is not None else lambda node: node.timestamp
+    tests = []
+    if name is not None:
+        if ignore_case:
+            pattern = name.lower()
+            tests.append(lambda node: fnmatch.fnmatchcase(node.name.lower(), pattern))
+        else:
+            tests.append(lambda node: fnmatch.fnmatchcase(node.name, name))
+    if kind is not None:
+        tests.append(lambda node: node.isdir() if kind == "d" else node.isfile())
+    if size is not None:
+        test_size = size_test(size)
+        tests.append(lambda node: test_size(size_of(node)))
+    if mtime is not None:
+        test_mtime = mtime_test(mtime)
+        tests.append(lambda node: test_mtime(timestamp_of(node)))
+
+    if not start.isdir():
+        nodes = [start]
+    else:
+        literals = glob_literals(name) if name is not None else []
+        if literals and (overlay is None or overlay.clean):
+            # the root of the tree is not in the index
+            nodes = [start] if start is system else []
+            nodes += [node for node in name_index(system).candidates(literals) if within(node, start)]
+        else:
+            nodes = [start]
+            nodes += walk(start) if overlay is None else overlay.walk(start)
+    for node in nodes:
+        if all(test(node) for test in tests):
+            yield node
+
+
+def grep_candidates(system: FileSystem, pattern: str, ignore_case: bool = False) -> set[File] | None:
+    """Files that can match the pattern according to the content index, None if every file can.
+
+    The first search starts building the index in the background and scans every file meanwhile.
+    """
+    literals = [literal.encode() for literal in regex_literals(pattern, ignore_case)]
+    if not literals:
+        return None
+    index = content_index(system, wait=False)
+    if index is None:
+        return None
+    return index.candidates(literals)
+
+
+def grep_files(system: FileSystem, directory: Directory, candidates: set[File] | None,
+               overlay: Overlay | None = None) -> Iterator[File]:
+    """Files below directory in tree order, only those among candidates unless candidates is None."""
+    if candidates is None:
+        return (node for node in (walk(directory) if overlay is None else overlay.walk(directory)) if node.isfile())
+    ids = content_index(system).ids
+    return iter(sorted((file for file in candidates if within(file, directory)), key=ids.__getitem__))
+
+
+def search_file(file: File, regex: re.Pattern) -> Iterator[Tuple[int, str]]:
+    """(line number, line) for every line of the file that matches the regex."""
+    return search_text(file.content, regex)
+
+
+def search_text(data, regex: re.Pattern) -> Iterator[Tuple[int, str]]:
+    """(line number, line) for every line of the bytes-like data that matches the regex.
+
+    Each line is scanned once: after a match the search goes on from the next line, and line starts and numbers
+    are tracked forward from the previous match.
+    """
+    content = str(data, "utf-8", "replace")
+    line_number = 1
+    line_start = 0
+    match = regex.search(content)
+    while match is not None:
+        start = match.start()
+        newline = content.rfind("\n", line_start, start)
+        if newline >= 0:
+            line_number += content.count("\n", line_start, newline + 1)
+            line_start = newline + 1
+        if line_start == len(content):
+            # an empty match after the last line break, there is no line there
+            return
+        line_end = content.find("\n", max(match.end() - 1, start))
+        if line_end < 0:
+            line_end = len(content)
+        yield line_number, content[line_start:line_end]
+        if line_end >= len(content):
+            return
+        line_number += content.count("\n", line_start, line_end + 1)
+        line_start = line_end + 1
+        match = regex.search(content, line_start)
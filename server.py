@@ -0,0 +1,107 @@
+import argparse
+import asyncio
+import collections
+
+from console import Shell, read_config, load_system, open_logger
+
+# Line protocol: the client sends one command line per line, the server answers with the output, a line break if
+# there was any output, the prompt and a NUL byte. The first answer, right after connecting, is the prompt alone.
+# NUL is reserved as the end-of-answer marker, NUL characters in the output are sent as ^@.
+END = b"\0"
+HISTORY_SIZE = 1000
+
+
+class Session:
+    """Per-connection state: a shell with its own cwd, prompt and status on the shared tree, and its history."""
+
+    def __init__(self, server: "Server"):
+        self.shell = Shell(server.config, server.system, server.logger)
+        self.history: collections.deque = collections.deque(maxlen=HISTORY_SIZE)
+
+    def builtin(self, line: str) -> str | None:
+        """Output of a session command that the shell does not know about, None for every other line."""
+        if line.strip() == "history":
+            return "\n".join(f"{i:>5}  {command}" for i, command in enumerate(self.history, 1))
+        return None
+
+
+class Server:
+    """Shell server that loads the image once and shares the tree, read-only, between every connection."""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.system = load_system(config)
+        self.logger = open_logger(config)
+        self.sessions: set[Session] = set()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        session = Session(self)
+        shell = session.shell
+        self.sessions.add(session)
+        try:
+            writer.write(self.encode(shell.prompt) + END)
+            await writer.drain()
+            while data := await reader.readline():
+                line = data.decode("utf-8", "replace").rstrip("\r\n")
+                if line.strip():
+                    session.history.append(line)
+                output = session.builtin(line)
+                written = False
+                if output is not None:
+                    writer.write(self.encode(output))
+                    written = bool(output)
+                else:
+                    # commands produce their output lazily, every chunk is computed off the event loop
+                    try:
+                        chunks = shell.stream(shell.onecmd(line))
+                        while (chunk := await loop.run_in_executor(None, next, chunks, None)) is not None:
+                            writer.write(self.encode(chunk))
+                            written = True
+                            await writer.drain()
+                    except SystemExit:
+                        break
+                    except ConnectionError:
+                        raise
+                    except Exception as e:
+                        # the command failed, not the connection: report it and keep the session open
+                        writer.write(self.encode(("\n" if written else "") + shell.fail(str(e))))
+                        written = True
+                writer.write(self.encode(("\n" if written else "") + shell.prompt) + END)
+                await writer.drain()
+        except ConnectionError:
+            shell.cancel()
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    @staticmethod
+    def encode(text: str) -> bytes:
+        return text.replace("\0", "^@").encode("utf-8", "surrogateescape")
+
+    async def serve(self, host: str | None = None, port: int | None = None, path: str | None = None):
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    config = read_config()
+    parser = argparse.ArgumentParser(description="Serve shell sessions on a shared image over TCP or a Unix socket.")
+    parser.add_argument("--host", default=config.get("server_host", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=config.get("server_port", 2323))
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    args = parser.parse_args()
+
+    server = Server(config)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
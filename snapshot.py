@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+import tarfile
+from array import array
+
+from structs import FileSystem, Directory, File, Archive
+
+# On-disk index of a filesystem image, stored next to the archive as "<archive>.idx".
+#
+#   header   MAGIC, archive size, archive mtime (ns), archive hash, node count, names blob length
+#   columns  parent id (-1 for the root), kind, size, mtime, content offset - one array each
+#   names    "\0"-joined utf-8 node names
+#
+# Nodes are written in pre-order, so a parent always comes before its children.
+
+MAGIC = b"GSEIDX01"
+HEADER = struct.Struct("<8sqq16sqq")
+SAMPLE = 1 << 20
+DIRECTORY, FILE = 0, 1
+
+
+def index_path(path: str) -> str:
+    return path + ".idx"
+
+
+def archive_key(path: str) -> tuple[int, int, bytes]:
+    """Size, mtime and a hash of the first and last megabyte of the archive."""
+    stat = os.stat(path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(stat.st_size.to_bytes(8, "little"))
+    with open(path, "rb") as file:
+        digest.update(file.read(SAMPLE))
+        if stat.st_size > SAMPLE:
+            file.seek(max(SAMPLE, stat.st_size - SAMPLE))
+            digest.update(file.read(SAMPLE))
+    return stat.st_size, stat.st_mtime_ns, digest.digest()
+
+
+def save(system: FileSystem, path: str):
+    parents, kinds, sizes, mtimes, offsets = array("q"), array("b"), array("q"), array("q"), array("q")
+    names = []
+    stack = [(-1, child) for child in reversed(system.children)]
+    while stack:
+        parent, node = stack.pop()
+        node_id = len(names)
+        names.append(node.name)
+        parents.append(parent)
+        mtimes.append(node.timestamp)
+        if node.isdir():
+            kinds.append(DIRECTORY)
+            sizes.append(0)
+            offsets.append(0)
+            stack.extend((node_id, child) for child in reversed(node.children))
+        else:
+            kinds.append(FILE)
+            sizes.append(node.size)
+            offsets.append(node.offset)
+
+    blob = "\0".join(names).encode("utf-8", "surrogateescape")
+    size, mtime, digest = archive_key(path)
+    tmp = index_path(path) + ".tmp"
+    with open(tmp, "wb") as file:
+        file.write(HEADER.pack(MAGIC, size, mtime, digest, len(names), len(blob)))
+        for column in (parents, kinds, sizes, mtimes, offsets):
+            column.tofile(file)
+        file.write(blob)
+    os.replace(tmp, index_path(path))
+
+
+def load(system: FileSystem, path: str) -> bool:
+    """Fill the system from the index, returns False if there is no valid index for the archive."""
+    try:
+        with open(index_path(path), "rb") as file:
+            data = file.read()
+    except OSError:
+        return False
+    if len(data) < HEADER.size:
+        return False
+    magic, size, mtime, digest, count, blob_length = HEADER.unpack_from(data)
+    if magic != MAGIC or (size, mtime, digest) != archive_key(path):
+        return False
+
+    view = memoryview(data)[HEADER.size:]
+    columns = []
+    for typecode in "qbqqq":
+        column = array(typecode)
+        length = count * column.itemsize
+        column.frombytes(view[:length])
+        view = view[length:]
+        columns.append(column)
+    if len(view) != blob_length:
+        return False
+    parents, kinds, sizes, mtimes, offsets = columns
+    names = bytes(view).decode("utf-8", "surrogateescape").split("\0") if count else []
+
+    archive = Archive(tarfile.open(path))
+    nodes: list[Directory | File | None] = [None] * count
+    for i in range(count):
+        parent = system if parents[i] < 0 else nodes[parents[i]]
+        name = names[i]
+        if kinds[i] == DIRECTORY:
+            nodes[i] = Directory(parent, name, mtimes[i])
+        else:
+            nodes[i] = File(parent, name, None, sizes[i], mtimes[i], archive, offsets[i])
+    system.aggregate_sizes()
+    system.changed()
+    return True
+
+
+def restore(system: FileSystem, path: str, lazy: bool = True):
+    """Load the system from its index, or parse the archive and write a fresh index if it is missing or stale."""
+    if lazy and load(system, path):
+        return
+    system.fill(tarfile.open(path), lazy)
+    if lazy:
+        try:
+            save(system, path)
+        except OSError:
+            # read-only location, the archive is parsed again next time
+            pass
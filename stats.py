@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Dict, Iterator, List, Tuple
+
+if TYPE_CHECKING:
+    import cProfile
+
+# phases a command is split into, render is the time the Qt console spends drawing its output
+PHASES = ("parse", "resolve", "format", "log", "render")
+# bucket i counts durations below 2**i microseconds, the last one everything longer
+BUCKETS = 32
+# marks the end of an output generator
+DONE = object()
+# returned by Stats.phase while recording is off
+DISABLED = nullcontext()
+
+
+class Histogram:
+    """Durations in power-of-two buckets of microseconds, with their count, sum and maximum."""
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.counts[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound in seconds of the bucket holding the given fraction of durations, capped at the maximum."""
+        rank = max(1, round(fraction * self.count))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(2 ** i / 1e6, self.max)
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1e3,
+            "max_ms": self.max * 1e3,
+            "p50_ms": self.percentile(0.5) * 1e3,
+            "p99_ms": self.percentile(0.99) * 1e3,
+            # upper bound in microseconds -> count, empty buckets left out
+            "buckets_us": {str(2 ** i): count for i, count in enumerate(self.counts) if count},
+        }
+
+
+class Phase:
+    """Times a phase of a command, time spent in phases nested in it counts for those only."""
+    __slots__ = ("stats", "command", "name", "start", "nested")
+
+    def __init__(self, stats: Stats, command: str, name: str):
+        self.stats = stats
+        self.command = command
+        self.name = name
+
+    def __enter__(self) -> Phase:
+        self.stats.stack.append(self)
+        self.nested = 0.0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stack = self.stats.stack
+        stack.pop()
+        if stack:
+            stack[-1].nested += elapsed
+        key = (self.command, self.name)
+        pending = self.stats.pending
+        pending[key] = pending.get(key, 0.0) + elapsed - self.nested
+
+
+class Stats:
+    """Per-command histograms of the time spent in each phase, recorded only while enabled.
+
+    Phases of a command line add up per (command, phase) and go into the histograms as one sample each when the
+    line is done, so a command that resolves three paths counts one resolve sample. The output of a command is
+    produced lazily: the time spent producing it is its format phase, wherever it is consumed.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.lock = threading.Lock()
+        # phases running on the thread executing the line, innermost last
+        self.stack: List[Phase] = []
+        self.pending: Dict[Tuple[str, str], float] = {}
+        # the command started last, phases outside any other count for it
+        self.command = ""
+
+    def phase(self, name: str, command: str | None = None):
+        if not self.enabled:
+            return DISABLED
+        if command is None:
+            command = self.stack[-1].command if self.stack else self.command
+        return Phase(self, command, name)
+
+    def timed(self, command: str, output):
+        """Output of a command, the time spent producing every chunk counted as its format phase."""
+        if not self.enabled or output is None or isinstance(output, str):
+            return output
+        return self.produce(command, iter(output))
+
+    def produce(self, command: str, output: Iterator[str]) -> Iterator[str]:
+        while True:
+            with Phase(self, command, "format"):
+                chunk = next(output, DONE)
+            if chunk is DONE:
+                return
+            yield chunk
+
+    def line(self, output: Iterator[str]) -> Iterator[str]:
+        """Output of a command line, its phases become samples once it is done."""
+        if not self.enabled:
+            return output
+        return self.finishing(output)
+
+    def finishing(self, output: Iterator[str]) -> Iterator[str]:
+        try:
+            yield from output
+        finally:
+            self.finish()
+
+    def finish(self):
+        """End of a command line, its phases become samples."""
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        with self.lock:
+            for key, seconds in pending.items():
+                self.histogram(key).add(seconds)
+
+    def record(self, command: str, phase: str, seconds: float):
+        """Add a sample measured outside the shell, like the time the console took to draw the output."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.histogram((command, phase)).add(seconds)
+
+    def histogram(self, key: Tuple[str, str]) -> Histogram:
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        return histogram
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def as_dict(self) -> dict:
+        """{command: {phase: histogram}}, phases in the order they run."""
+        with self.lock:
+            commands = {}
+            for (command, phase), histogram in sorted(self.histograms.items(),
+                                                      key=lambda item: (item[0][0], PHASES.index(item[0][1]))):
+                commands.setdefault(command, {})[phase] = histogram.as_dict()
+        return {"enabled": self.enabled, "commands": commands}
+
+    def table(self) -> Iterator[str]:
+        """Lines of a table of every histogram, times in milliseconds."""
+        yield f"{'command':<10} {'phase':<8} {'count':>7} {'mean':>9} {'p50':>9} {'p99':>9} {'max':>9}"
+        for command, phases in self.as_dict()["commands"].items():
+            for phase, histogram in phases.items():
+                mean = histogram["total_ms"] / histogram["count"]
+                yield (f"{command:<10} {phase:<8} {histogram['count']:>7} {mean:>9.3f} {histogram['p50_ms']:>9.3f} "
+                       f"{histogram['p99_ms']:>9.3f} {histogram['max_ms']:>9.3f}")
+
+
+class Profiler:
+    """Runs cProfile or tracemalloc over a session and writes the reports to a directory when stopped.
+
+    cProfile sees one thread per profile: the thread that starts the profiler is profiled, other threads that run
+    commands wrap their work in `thread()`. tracemalloc traces every thread.
+    """
+
+    def __init__(self, kind: str, directory: str = "."):
+        if kind not in ("cpu", "memory"):
+            raise ValueError(f"unknown profile kind: {kind}")
+        self.kind = kind
+        self.directory = directory
+        self.prefix = os.path.join(directory, f"{time.strftime('profile-%Y%m%d-%H%M%S')}-{os.getpid()}")
+        # thread name -> its profile
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        # profilers are imported only when a session is profiled
+        import tracemalloc
+
+        if self.kind == "memory":
+            tracemalloc.start(25)
+        else:
+            self.profile().enable()
+
+    def profile(self) -> cProfile.Profile:
+        import cProfile
+
+        name = threading.current_thread().name
+        with self.lock:
+            profile = self.profiles.get(name)
+            if profile is None:
+                profile = self.profiles[name] = cProfile.Profile()
+        return profile
+
+    def thread(self):
+        """Context manager that profiles the current thread while it is active."""
+        if self.kind != "cpu":
+            return nullcontext()
+        return self.profile()
+
+    def stop(self) -> List[str]:
+        """Stop profiling and write the reports, returns their paths."""
+        import io
+        import pstats
+        import tracemalloc
+
+        os.makedirs(self.directory, exist_ok=True)
+        paths = []
+        if self.kind == "memory":
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            path = self.prefix + "-memory.txt"
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(f"current {current} bytes, peak {peak} bytes\n\n")
+                for statistic in snapshot.statistics("traceback")[:50]:
+                    file.write(f"{statistic}\n")
+                    for line in statistic.traceback.format()[-6:]:
+                        file.write(f"    {line}\n")
+            return [path]
+        for name, profile in self.profiles.items():
+            profile.disable()
+            path = f"{self.prefix}-{name}"
+            # binary stats for pstats or snakeviz, and a text report sorted by cumulative time
+            profile.dump_stats(path + ".prof")
+            report = io.StringIO()
+            pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(50)
+            with open(path + ".txt", "w", encoding="utf-8") as file:
+                file.write(report.getvalue())
+            paths.extend((path + ".prof", path + ".txt"))
+        return paths
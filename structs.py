@@ -1,21 +1,120 @@
 from __future__ import annotations
 
-from typing import List
-from tarfile import TarFile
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Tuple, ValuesView
 from datetime import datetime
-from pathlib import Path
+from operator import attrgetter
 import argparse
+import io
+import mmap
+import os
+import sys
+import threading
+
+if TYPE_CHECKING:
+    from tarfile import TarFile
+
+
+def normalize(path: str) -> Tuple[bool, List[str]]:
+    """(absolute, parts) of a path, without empty and "." parts and with every ".." folded into the part before it.
+
+    A relative path keeps the ".." parts that go above its start, an absolute one drops them since /.. is /.
+    """
+    absolute = path.startswith("/")
+    parts: List[str] = []
+    for part in path.split("/"):
+        if part == "" or part == ".":
+            continue
+        if part == "..":
+            if parts and parts[-1] != "..":
+                parts.pop()
+            elif not absolute:
+                parts.append(part)
+            continue
+        parts.append(part)
+    return absolute, parts
+
+
+class LRUCache:
+    """Dict bounded to `size` entries that evicts the least recently used one, counting hits and misses.
+
+    Not thread-safe, each owner keeps its own.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.size:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+    def __len__(self) -> int:
+        return len(self.data)
 
 
 class Object:
-    def __init__(self, parent: Directory | FileSystem | None, name: str, mtime: datetime | None):
+    # slotted nodes: no per-instance __dict__, mtime kept as an int timestamp, abspath derived from the parent's
+    __slots__ = ("parent", "name", "_mtime", "size")
+
+    def __init__(self, parent: Directory | FileSystem | None, name: str, mtime: datetime | int | None):
         self.parent = parent
-        self.name = name
+        self.name = sys.intern(name)
         self.mtime = mtime
         self.size = 0
-        self.abspath = self.get_abspath()
+        # constructing links the node without touching ancestor sizes, which are aggregated once after a load,
+        # Directory.add keeps them up to date afterwards
         if self.parent is not None:
-            self.parent.children.append(self)
+            self.parent.index[self.name] = self
+
+    @property
+    def mtime(self) -> datetime | None:
+        return datetime.fromtimestamp(self._mtime) if self._mtime is not None else None
+
+    @mtime.setter
+    def mtime(self, mtime: datetime | int | None):
+        self._mtime = int(mtime.timestamp()) if isinstance(mtime, datetime) else mtime
+
+    @property
+    def timestamp(self) -> int:
+        return self._mtime or 0
+
+    @property
+    def abspath(self) -> str:
+        # walk up to the nearest directory with a known path instead of recursing, trees can be deeper than the
+        # recursion limit, then build the path back down and cache it in the directories on the way
+        nodes = []
+        node = self
+        while node is not None and not isinstance(node, FileSystem) and (not node.isdir() or node._abspath is None):
+            nodes.append(node)
+            node = node.parent
+        if node is None:
+            # a detached subtree, its top node has no leading /
+            path = nodes.pop().name
+        else:
+            path = node.abspath
+        for node in reversed(nodes):
+            path = (path if path != "/" else "") + "/" + node.name
+            if node.isdir():
+                node._abspath = path
+        return path
 
     def get_name(self) -> str:
         return self.name
@@ -24,12 +123,7 @@ class Object:
         return self.parent
 
     def get_abspath(self) -> str:
-        path = self.name
-        p = self.parent
-        while p is not None:
-            path = p.name + "/" + path
-            p = p.parent
-        return path
+        return self.abspath
 
     def isdir(self):
         return isinstance(self, Directory)
@@ -39,105 +133,296 @@ class Object:
 
 
 class Directory(Object):
-    def __init__(self, parent: Directory | FileSystem | None, name: str, mtime: datetime | None):
+    __slots__ = ("index", "_abspath")
+
+    def __init__(self, parent: Directory | FileSystem | None, name: str, mtime: datetime | int | None):
         super().__init__(parent, name, mtime)
-        self.children: List[Directory | File] = []
-
-    def get_child(self, name: str) -> Directory | None:
-        for child in self.children:
-            if child.get_name() == name:
-                return child
-        return None
-
-    def search_by_coord(self, path: str) -> File | Directory | None:
-        # /
-        if path == "/":
-            obj = self
-            while obj.parent is not None:
-                obj = obj.parent
-            return obj
-        if path == ".":
-            return self
-        if path == "..":
-            if self.parent is not None:
-                return self.parent
+        # name -> child, in insertion order
+        self.index: Dict[str, Directory | File] = {}
+        self._abspath: str | None = None
+
+    @property
+    def children(self) -> ValuesView[Directory | File]:
+        return self.index.values()
+
+    @property
+    def abspath(self) -> str:
+        # directories cache their path, files and subdirectories build on it
+        if self._abspath is None:
+            return Object.abspath.fget(self)
+        return self._abspath
+
+    def add(self, child: Directory | File):
+        """Attach a detached node, replacing a child of the same name, and add its size to every ancestor."""
+        self.remove(child.name)
+        child.parent = self
+        self.index[child.name] = child
+        if child.isdir():
+            child.forget_paths()
+        self.propagate(child.size)
+
+    def remove(self, name: str) -> Directory | File | None:
+        """Detach a child and subtract its size from every ancestor."""
+        child = self.index.pop(name, None)
+        if child is None:
+            return None
+        child.parent = None
+        self.propagate(-child.size)
+        return child
+
+    def propagate(self, delta: int):
+        """Add delta to the size of this directory and its ancestors, and mark the tree as changed."""
+        p = self
+        root = self
+        while p is not None:
+            p.size += delta
+            root = p
+            p = p.parent
+        if isinstance(root, FileSystem):
+            root.changed()
+
+    def forget_paths(self):
+        """Drop the cached paths of this directory and its subdirectories after it has been moved."""
+        stack = [self]
+        while stack:
+            directory = stack.pop()
+            directory._abspath = None
+            stack.extend(child for child in directory.children if child.isdir())
+
+    def aggregate_sizes(self):
+        """Recompute directory sizes bottom-up in a single post-order pass."""
+        stack = [(self, False)]
+        while stack:
+            directory, visited = stack.pop()
+            if visited:
+                directory.size = sum(child.size for child in directory.children)
             else:
-                return self
-        # /dir
-        if path.startswith("/"):
-            obj = self
-            while obj.parent is not None:
-                obj = obj.parent
-            parts = list(filter(lambda x: bool(x), path.split("/")[1:]))
-            for part in parts:
-                if obj.get_child(part):
-                    obj = obj.get_child(part)
-                else:
-                    return None
-            return obj
-        # ..dir or ../dir
-        if path.startswith(".."):
-            obj = self.parent
-            parts = list(filter(lambda x: bool(x), path[2:].split("/")))
-            for part in parts:
-                if obj.get_child(part):
-                    obj = obj.get_child(part)
-                else:
-                    return None
-            return obj
-        # .dir or ./dir/file.txt
-        if path.startswith("."):
-            obj = self
-            parts = list(filter(lambda x: bool(x), path[1:].split("/")))
-            for part in parts:
-                if obj.get_child(part):
-                    obj = obj.get_child(part)
-                else:
-                    return None
-            return obj
-        # dir or dir/file.txt
-        parts = list(filter(lambda x: bool(x), path.split("/")))
-        obj = self
+                stack.append((directory, True))
+                stack.extend((child, False) for child in directory.children if child.isdir())
+
+    def get_child(self, name: str) -> Directory | File | None:
+        return self.index.get(name)
+
+    @staticmethod
+    def walk(obj: Directory | File | None, parts: List[str],
+             child: Callable[[Directory, str], Directory | File | None] | None = None) -> Directory | File | None:
         for part in parts:
-            if obj.get_child(part):
-                obj = obj.get_child(part)
-            else:
+            if obj is None or not obj.isdir():
                 return None
+            obj = obj.get_child(part) if child is None else child(obj, part)
         return obj
 
+    def search_by_coord(self, path: str,
+                        child: Callable[[Directory, str], Directory | File | None] | None = None,
+                        parent: Callable[[Directory | File], Directory | None] | None = None
+                        ) -> File | Directory | None:
+        """Node at path relative to this directory.
+
+        child(directory, name) replaces get_child and parent(node) the parent pointer when given.
+        """
+        if parent is None:
+            parent = attrgetter("parent")
+        absolute, parts = normalize(path)
+        obj = self
+        if absolute:
+            while parent(obj) is not None:
+                obj = parent(obj)
+        # only a relative path keeps ".." parts, all of them leading
+        up = 0
+        while up < len(parts) and parts[up] == "..":
+            if parent(obj) is not None:
+                obj = parent(obj)
+            up += 1
+        return self.walk(obj, parts[up:], child)
+
+
+class Archive:
+    """Random access to member data of an opened tar archive.
+
+    Uncompressed archives on disk are memory mapped, anything else falls back to seek-and-read on the
+    archive's file object.
+    """
+
+    def __init__(self, tarfile: TarFile):
+        self.tarfile = tarfile
+        # None when the archive was opened from a file object
+        self.path: str | None = tarfile.name
+        self.lock = threading.Lock()
+        self.mmap = None
+        if isinstance(tarfile.fileobj, io.BufferedReader):
+            try:
+                self.mmap = mmap.mmap(tarfile.fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # empty or unmappable file
+                self.mmap = None
+
+    def read(self, offset: int, size: int) -> bytes:
+        if self.mmap is not None:
+            return self.mmap[offset:offset + size]
+        with self.lock:
+            self.tarfile.fileobj.seek(offset)
+            return self.tarfile.fileobj.read(size)
+
+    def view(self, offset: int, size: int) -> memoryview | None:
+        """A zero-copy view of the data, None if the archive is not memory mapped."""
+        if self.mmap is None:
+            return None
+        return memoryview(self.mmap)[offset:offset + size]
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+        self.tarfile.close()
+
 
 class File(Object):
-    def __init__(self, parent: Directory | FileSystem | None, name: str, extension: str, content: bytes, size: int,
-                 mtime: datetime | None):
+    __slots__ = ("_content", "archive", "offset")
+
+    def __init__(self, parent: Directory | FileSystem | None, name: str, content: bytes | None, size: int,
+                 mtime: datetime | int | None, archive: Archive | None = None, offset: int = 0):
         super().__init__(parent, name, mtime)
-        self.extension = extension
-        self.content = content
+        self._content = content
+        self.archive = archive
+        self.offset = offset
         self.size = size
 
-        p = self.parent
-        while p is not None:
-            p.size += self.size
-            p = p.parent
+    @property
+    def extension(self) -> str:
+        return os.path.splitext(self.name)[1]
+
+    @property
+    def content(self) -> bytes:
+        # lazy files are read from the archive on every access and never kept in memory
+        if self._content is None:
+            if self.archive is None:
+                return b""
+            return self.archive.read(self.offset, self.size)
+        return self._content
+
+    def location(self) -> Tuple[str, int, int] | None:
+        """Archive path, data offset and size, for readers in other processes. None for in-memory content."""
+        if self._content is not None or self.archive is None or self.archive.path is None:
+            return None
+        return self.archive.path, self.offset, self.size
+
+    def chunks(self, chunk_size: int, start: int = 0, stop: int | None = None) -> Iterator[memoryview]:
+        """Yield bytes [start, stop) of the content in chunks, without copying when the data is in memory."""
+        stop = self.size if stop is None else min(stop, self.size)
+        data = None
+        if self._content is not None:
+            data = memoryview(self._content)
+        elif self.archive is not None:
+            data = self.archive.view(self.offset, self.size)
+        for position in range(max(start, 0), stop, chunk_size):
+            end = min(position + chunk_size, stop)
+            if data is not None:
+                yield data[position:end]
+            elif self.archive is not None:
+                yield memoryview(self.archive.read(self.offset + position, end - position))
 
 
 class FileSystem(Directory):
+    __slots__ = ("ready", "error", "generation", "cache", "early")
+
     def __init__(self):
         super().__init__(None, "", None)
-        self.abspath = "/"
-
-    def fill(self, tarfile: TarFile):
-        for member in tarfile.getmembers()[1:]:
-            current = self
-            parts = member.path.split("/")[1:]
-            for part in parts:
-                if current.get_child(part):
-                    current = current.get_child(part)
-                else:
-                    if member.isfile():
-                        File(current, part, Path(part).suffix, tarfile.extractfile(member).read(), member.size,
-                             datetime.fromtimestamp(member.mtime))
-                    elif member.isdir():
-                        Directory(current, part, datetime.fromtimestamp(member.mtime))
+        # cleared while a background load is running
+        self.ready = threading.Event()
+        self.ready.set()
+        self.error: BaseException | None = None
+        # bumped on every change to the tree, structures derived from it are kept in cache until then
+        self.generation = 0
+        self.cache: dict = {}
+        # set while a load runs whose nodes are final once created, commands on them need not wait for the rest
+        self.early = False
+
+    def changed(self):
+        self.generation += 1
+        self.cache.clear()
+
+    def fill(self, tarfile: TarFile, lazy: bool = True):
+        """Build the tree in a single streaming pass over the archive.
+
+        The first path component of every member is the image root and is skipped. Missing intermediate
+        directories are created on the way, and the parent of the previous member is reused for its siblings.
+        """
+        archive = Archive(tarfile) if lazy else None
+        if archive is not None and archive.mmap is None:
+            # reading a file early would compete with this pass for the archive's file object
+            self.early = False
+        parent_path = ""
+        parent: Directory | None = self
+        member = tarfile.next()
+        while member is not None:
+            parts = [part for part in member.name.split("/") if part and part != "."][1:]
+            if parts:
+                mtime = int(member.mtime)
+                dirname = "/".join(parts[:-1])
+                if dirname != parent_path:
+                    parent = self.make_dirs(parts[:-1], mtime)
+                    parent_path = dirname
+                # parent is None when a file stands where a directory is expected
+                if parent is not None:
+                    name = parts[-1]
+                    existing = parent.get_child(name)
+                    if member.isdir():
+                        if existing is None:
+                            Directory(parent, name, mtime)
+                        else:
+                            # created earlier as an intermediate directory
+                            existing.mtime = mtime
+                    elif member.isfile() and existing is None:
+                        if lazy:
+                            File(parent, name, None, member.size, mtime, archive, member.offset_data)
+                        else:
+                            File(parent, name, tarfile.extractfile(member).read(), member.size, mtime)
+            # TarFile caches every member it reads, drop them so memory does not grow with the archive
+            tarfile.members.clear()
+            member = tarfile.next()
+        self.aggregate_sizes()
+        self.changed()
+
+    def make_dirs(self, parts: List[str], mtime: int) -> Directory | None:
+        current: Directory = self
+        for part in parts:
+            child = current.get_child(part)
+            if child is None:
+                child = Directory(current, part, mtime)
+            elif not child.isdir():
+                return None
+            current = child
+        return current
+
+    @property
+    def abspath(self) -> str:
+        return "/"
+
+    def fill_async(self, tarfile: TarFile, lazy: bool = True) -> threading.Thread:
+        """Run fill in a background thread, wait() blocks until it is done."""
+        return self.load_async(self.fill, tarfile, lazy)
+
+    def load_async(self, loader, *args) -> threading.Thread:
+        """Run loader(*args) in a background thread, wait() blocks until it is done."""
+        self.ready.clear()
+
+        def target():
+            try:
+                loader(*args)
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.early = False
+                self.changed()
+                self.ready.set()
+
+        thread = threading.Thread(target=target, name="fill", daemon=True)
+        thread.start()
+        return thread
+
+    def wait(self):
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
 
 
 # rewritten argparse._HelpAction
@@ -165,6 +450,35 @@ class ArgumentError(Exception):
         super().__init__(message)
 
 
+class CommandCancelled(Exception):
+    pass
+
+
 class ArgumentParser(argparse.ArgumentParser):
+    def __init__(self, *args, intermixed: bool = False, signed: Tuple[str, ...] = (), **kwargs):
+        """intermixed lets options follow positionals, the values of the signed options may start with a -."""
+        super().__init__(*args, **kwargs)
+        self.intermixed = intermixed
+        self.signed = signed
+
+    def parse_args(self, args=None, namespace=None):
+        if self.intermixed:
+            return self.parse_intermixed_args(args, namespace)
+        return super().parse_args(args, namespace)
+
+    def parse_known_args(self, args=None, namespace=None):
+        if self.signed and args is not None:
+            # argparse takes a value like -1k for an option, joined to its option it stays a value
+            joined = []
+            words = iter(args)
+            for word in words:
+                if word in self.signed:
+                    value = next(words, None)
+                    joined.append(word if value is None else f"{word}={value}")
+                else:
+                    joined.append(word)
+            args = joined
+        return super().parse_known_args(args, namespace)
+
     def error(self, message):
         raise ArgumentError(f"{self.prog}: {message}")